@@ -1,3 +1,4 @@
+import os
 from datetime import datetime, timedelta
 
 from src.transnet.transnet_api import TransnetAPI
@@ -17,8 +18,7 @@ if __name__ == "__main__":
 
         print("ROWS", num_rows)
         if num_rows < 96:
-            cmols = ta.get_picasso_cmol(dt)
-            ta.upload_lmols(cmols)
-            ta.upload_cmols(cmols)
+            cmols = ta.get_picasso_cmol(dt, processes=os.cpu_count())
+            ta.upload_mols(cmols)
 
         dt = ndt
\ No newline at end of file
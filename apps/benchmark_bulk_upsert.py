@@ -0,0 +1,90 @@
+import datetime
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.utils.database.nxtdatabase import NXTDatabase
+
+# Compares the parameterized, chunked NXTDatabase.bulk_upsert with the former single-statement string builder.
+# Statement preparation is always timed; set BENCH_MYSQL_HOST/USER/PASSWORD/DATABASE to a local MySQL to also time
+# the round trips against a scratch table (BENCH_BULK_UPSERT, dropped afterwards).
+# usage: benchmark_bulk_upsert.py [rows]
+
+TABLE = "BENCH_BULK_UPSERT"
+KEY_COLS = ["UTCTIME", "BUYERAREA", "SELLERAREA"]
+DATA_COLS = ["VOLUME", "PRICE"]
+
+
+def make_frame(rows):
+    areas = np.array(["BE", "NL", "FR", "DE", "GB"])
+    return pd.DataFrame({
+        "UTCTIME": pd.Timestamp("2025-01-01") + pd.to_timedelta(np.arange(rows) // 20 * 15, unit="min"),
+        "BUYERAREA": areas[np.arange(rows) % 5],
+        "SELLERAREA": areas[np.arange(rows) // 5 % 4],
+        "VOLUME": np.round(np.random.rand(rows) * 100, 1),
+        "PRICE": np.where(np.random.rand(rows) < 0.01, np.nan, np.round(np.random.rand(rows) * 200 - 50, 2)),
+    })
+
+
+def legacy_upsert_query(df, table, key_cols, data_cols, moddate_col):
+    # the string builder bulk_upsert used before it was parameterized
+    df = df.copy()
+    df[moddate_col] = datetime.datetime.utcnow()
+    data_cols = data_cols + [moddate_col]
+
+    update_str = ",".join(f'{table}.{col} = t.{col}' for col in data_cols)
+    value_str = "),(".join([",".join(["'" + str(row[k]) + "'" if not pd.isnull(row[k]) else 'NULL' for k in key_cols + data_cols]) for i, row in df[key_cols + data_cols].iterrows()])
+
+    return f"""
+        INSERT INTO {table} ({",".join(key_cols + data_cols)})
+        VALUES ({value_str}) as t({",".join(key_cols + data_cols)})
+        ON DUPLICATE KEY UPDATE
+        {update_str}
+    """
+
+
+def timed(label, rows, fn):
+    t = time.time()
+    try:
+        fn()
+    except Exception as e:
+        print(f"{label:>32}: failed after {time.time() - t:.1f}s ({type(e).__name__}: {str(e)[:100]})")
+        return
+
+    elapsed = time.time() - t
+    print(f"{label:>32}: {elapsed:.1f}s, {rows / elapsed:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = make_frame(rows)
+    db = NXTDatabase(server=os.getenv("BENCH_MYSQL_HOST", "localhost"), user=os.getenv("BENCH_MYSQL_USER", ""), password=os.getenv("BENCH_MYSQL_PASSWORD", ""), database=os.getenv("BENCH_MYSQL_DATABASE", ""))
+
+    timed("prepare string literal", rows, lambda: legacy_upsert_query(df, TABLE, KEY_COLS, DATA_COLS, "CREATIONDATE"))
+    timed("prepare parameterized chunks", rows, lambda: list(db._upsert_statements(df, TABLE, KEY_COLS, DATA_COLS, "CREATIONDATE", 5000)))
+
+    if os.getenv("BENCH_MYSQL_HOST") is None:
+        print("BENCH_MYSQL_HOST not set, skipping database round trips")
+        sys.exit(0)
+
+    with db.engine.connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"CREATE TABLE {TABLE} (UTCTIME DATETIME, BUYERAREA VARCHAR(8), SELLERAREA VARCHAR(8), VOLUME DOUBLE, PRICE DOUBLE, CREATIONDATE DATETIME, PRIMARY KEY (UTCTIME, BUYERAREA, SELLERAREA))"))
+
+    try:
+        def legacy():
+            with db.engine.connect() as conn:
+                t = conn.begin()
+                conn.execute(text(legacy_upsert_query(df, TABLE, KEY_COLS, DATA_COLS, "CREATIONDATE")))
+                t.commit()
+
+        timed("string literal upsert", rows, legacy)
+        for chunksize in (1000, 5000, 20000):
+            timed(f"parameterized upsert ({chunksize})", rows, lambda: db.bulk_upsert(df, TABLE, KEY_COLS, DATA_COLS, moddate_col="CREATIONDATE", chunksize=chunksize))
+    finally:
+        with db.engine.connect() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
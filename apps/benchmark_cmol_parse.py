@@ -0,0 +1,62 @@
+import sys
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import requests
+
+from src.transnet.transnet_api import TransnetAPI, PICASSO_CMOL_URL, MOL_QUANTILES
+
+# Compares the tree-based and the streaming (iterparse) CMOL parser on a full day archive.
+# usage: benchmark_cmol_parse.py [YYYY-MM-DD | archive.zip]
+
+def load_archive(arg):
+    if arg.endswith(".zip"):
+        with open(arg, "rb") as f:
+            return f.read()
+
+    dt = datetime.strptime(arg, "%Y-%m-%d")
+    r = requests.get(PICASSO_CMOL_URL.format(dt.strftime("%Y%m%d")), headers={"User-Agent": "Mozilla/5.0"}, timeout=60)
+    r.raise_for_status()
+    return r.content
+
+
+def parse_all(content, streaming, trace=False):
+    cmols = []
+    peak = 0
+
+    with zipfile.ZipFile(BytesIO(content)) as zip_file:
+        for file_name in sorted(zip_file.namelist(), reverse=True):
+            with zip_file.open(file_name) as file:
+                if trace:
+                    tracemalloc.start()
+
+                cmols.append(TransnetAPI.parse_xml(file, streaming=streaming))
+
+                if trace:
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+
+    return cmols, peak
+
+
+if __name__ == "__main__":
+    content = load_archive(sys.argv[1] if len(sys.argv) > 1 else datetime.utcnow().strftime("%Y-%m-%d"))
+
+    results = {}
+    for streaming in (False, True):
+        t = time.time()
+        cmols, _ = parse_all(content, streaming)
+        elapsed = time.time() - t
+
+        _, peak = parse_all(content, streaming, trace=True)
+
+        results[streaming] = cmols
+        print(f"{'streaming' if streaming else 'tree':>9}: {len(cmols)} files in {elapsed:.2f}s, peak memory per file {peak / 1e6:.1f} MB")
+
+    for tree, streamed in zip(results[False], results[True]):
+        assert tree.to_cmol_df(MOL_QUANTILES).equals(streamed.to_cmol_df(MOL_QUANTILES)), f"Mismatch for {tree.start_utc}"
+
+    print("Results identical")
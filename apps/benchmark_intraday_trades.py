@@ -0,0 +1,26 @@
+import sys
+
+from apps.intraday_benchmark_utils import load_trades, pipeline, to_wide, to_compact, normalized, measure
+
+# Runs the netborder and LT stats pipeline on the same trades in the former wide schema (object areas, float64)
+# and in the compact trade schema, reporting frame memory, run time and peak allocations.
+# usage: benchmark_intraday_trades.py [number of synthetic trades | YYYY-MM-DD days]
+
+if __name__ == "__main__":
+    it = pipeline()
+    trades = load_trades(sys.argv[1:])
+
+    results = {}
+    for name, schema in (("wide", to_wide), ("compact", to_compact)):
+        frame = schema(trades)
+        netborder, nb_elapsed, nb_peak = measure(lambda: it.calculate_netborder(frame))
+        stats, stats_elapsed, stats_peak = measure(lambda: it.get_xbid_stats_lt(frame))
+        results[name] = (netborder[0], stats)
+
+        print(f"{name:>8}: {len(frame)} trades, {frame.memory_usage(deep=True).sum() / 1e6:.0f} MB | "
+              f"netborder {nb_elapsed:.2f}s peak {nb_peak / 1e6:.0f} MB | "
+              f"LT stats {stats_elapsed:.2f}s peak {stats_peak / 1e6:.0f} MB")
+
+    for wide, compact in zip(results["wide"], results["compact"]):
+        assert normalized(wide).equals(normalized(compact)), "Results differ"
+    print("Results identical")
@@ -0,0 +1,40 @@
+import datetime
+import sys
+
+import numpy as np
+import pandas as pd
+
+from apps.intraday_benchmark_utils import load_trades, pipeline, to_compact, measure
+
+# Compares the former shifted copies of the half-hour and hour products with the repeat based quarter-hour expansion.
+# usage: benchmark_quarter_hour_expansion.py [number of synthetic trades | YYYY-MM-DD days]
+
+
+def legacy_expand_to_quarter_hours(trades_grouped):
+    duration = trades_grouped["DELIVERYENDUTC"] - trades_grouped["DELIVERYSTARTUTC"]
+    netborder_q = trades_grouped[duration == datetime.timedelta(minutes=15)].set_index("DELIVERYSTARTUTC")
+    netborder_hh = trades_grouped[duration == datetime.timedelta(minutes=30)].set_index("DELIVERYSTARTUTC")
+    netborder_h = trades_grouped[duration == datetime.timedelta(minutes=60)].set_index("DELIVERYSTARTUTC")
+
+    shifted = [netborder_q, netborder_hh, netborder_h]
+    for nb, quarters in ((netborder_hh, 2), (netborder_h, 4)):
+        for quarter in range(1, quarters):
+            nb = nb.copy()
+            nb.index += datetime.timedelta(minutes=15)
+            shifted.append(nb)
+
+    return pd.concat(shifted)[["BUYERAREA", "SELLERAREA", "VOLPRICE", "VOLUME"]].reset_index()
+
+
+if __name__ == "__main__":
+    it = pipeline()
+    trades_grouped = it._aggregate_trades(to_compact(load_trades(sys.argv[1:])))
+
+    expansions = {}
+    for name, expand in (("copies", legacy_expand_to_quarter_hours), ("repeat", it._expand_to_quarter_hours)):
+        netborder, elapsed, peak = measure(lambda: expand(trades_grouped).groupby(["DELIVERYSTARTUTC", "BUYERAREA", "SELLERAREA"], observed=True)[["VOLPRICE", "VOLUME"]].sum())
+        expansions[name] = netborder
+        print(f"{name:>8}: {len(trades_grouped)} products -> {len(netborder)} quarter-hours | {elapsed:.2f}s peak {peak / 1e6:.0f} MB")
+
+    assert np.allclose(expansions["copies"], expansions["repeat"], rtol=1e-12, atol=0) and expansions["copies"].index.equals(expansions["repeat"].index), "Expansion differs"
+    print("Expansion identical")
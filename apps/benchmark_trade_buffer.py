@@ -0,0 +1,48 @@
+import datetime
+import sys
+
+import numpy as np
+import pandas as pd
+
+from apps.intraday_benchmark_utils import load_trades, to_compact, measure
+from src.intraday.trade_buffer import TradeBuffer
+
+# Compares the live trades kept by filtering and concatenating the frame every poll with a TradeBuffer of day chunks.
+# usage: benchmark_trade_buffer.py [number of synthetic trades | YYYY-MM-DD days]
+
+
+def polled_trades(trades, polls=600):
+    # two days of trades, then the trades of one minute per poll, with the window moving an hour every 60 polls
+    frame = to_compact(trades).sort_values("TRADETIMEUTC", kind="stable").reset_index(drop=True)
+    poll_times = frame["TRADETIMEUTC"].iloc[len(frame) // 2] + pd.to_timedelta(np.arange(polls + 1), unit="min")
+    first = frame["TRADETIMEUTC"].searchsorted(poll_times)
+    froms = poll_times.floor("H") - datetime.timedelta(days=1)
+    initial = frame.iloc[:first[0]]
+    return initial[initial["DELIVERYSTARTUTC"] >= froms[0]], [(froms[i], frame.iloc[first[i]:first[i + 1]]) for i in range(polls)]
+
+
+def concat_polls(initial, polls):
+    live = initial
+    for from_utc, new in polls:
+        live = pd.concat([live[live["DELIVERYSTARTUTC"] >= from_utc], new])
+    return live[live["DELIVERYSTARTUTC"] >= polls[-1][0]]
+
+
+def buffer_polls(initial, polls):
+    buffer = TradeBuffer()
+    buffer.append(initial)
+    for from_utc, new in polls:
+        buffer.evict(from_utc)
+        buffer.append(new[new["DELIVERYSTARTUTC"] >= from_utc])
+    return buffer.to_frame(polls[-1][0])
+
+
+if __name__ == "__main__":
+    initial, polls = polled_trades(load_trades(sys.argv[1:]))
+
+    concatenated, concat_elapsed, concat_peak = measure(lambda: concat_polls(initial, polls))
+    buffered, buffer_elapsed, buffer_peak = measure(lambda: buffer_polls(initial, polls))
+    print(f"    live: {len(initial)} trades + {len(polls)} polls of {np.mean([len(new) for _, new in polls]):.0f} | "
+          f"filter + concat {concat_elapsed:.2f}s peak {concat_peak / 1e6:.0f} MB | buffer {buffer_elapsed:.2f}s peak {buffer_peak / 1e6:.0f} MB")
+    assert concatenated.sort_values("ID").equals(buffered.sort_values("ID")), "Live trades differ"
+    print("Live trades identical")
@@ -0,0 +1,45 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from apps.intraday_benchmark_utils import load_trades, pipeline, to_compact, measure
+
+# Compares the former occurrence counter + MultiIndex isin EPEX/Nordpool dedup with the hashed one.
+# usage: benchmark_trade_dedup.py [number of synthetic trades | YYYY-MM-DD days]
+
+
+def overlapping_trades(trades, seed=0):
+    # nordpool sees 70% of the epex trades plus trades of its own, with some identities repeated on both sides
+    rnd = np.random.default_rng(seed)
+    epex_trades = trades[rnd.random(len(trades)) < 0.6]
+    np_trades = pd.concat([epex_trades.sample(frac=0.7, random_state=seed), trades.drop(epex_trades.index)], ignore_index=True)
+    epex_trades = pd.concat([epex_trades, epex_trades.sample(frac=0.05, random_state=seed)], ignore_index=True)
+    np_trades = pd.concat([np_trades, np_trades.sample(frac=0.05, random_state=seed + 1)], ignore_index=True)
+    return epex_trades.reset_index(drop=True), np_trades
+
+
+def legacy_concat_unique(it, epex_trades, np_trades):
+    epex_trades, np_trades = epex_trades.copy(), np_trades.copy()
+    epex_trades["OCCURRENCES"] = epex_trades.groupby(it._id_cols, observed=True).cumcount()
+    np_trades["OCCURRENCES"] = np_trades.groupby(it._id_cols, observed=True).cumcount()
+
+    epex_index = pd.MultiIndex.from_frame(epex_trades[it._id_cols + ["OCCURRENCES"]])
+    np_index = pd.MultiIndex.from_frame(np_trades[it._id_cols + ["OCCURRENCES"]])
+    np_trades = np_trades[~np_index.isin(epex_index)]
+
+    return pd.concat([epex_trades, np_trades], ignore_index=True).drop(columns="OCCURRENCES")
+
+
+if __name__ == "__main__":
+    it = pipeline()
+    epex_trades, np_trades = overlapping_trades(to_compact(load_trades(sys.argv[1:])))
+
+    legacy, legacy_elapsed, legacy_peak = measure(lambda: legacy_concat_unique(it, epex_trades, np_trades))
+    hashed, hashed_elapsed, hashed_peak = measure(lambda: it._concat_unique(epex_trades, np_trades))
+
+    print(f"   dedup: {len(epex_trades)} epex + {len(np_trades)} nordpool -> {len(hashed)} trades | "
+          f"isin {legacy_elapsed:.2f}s peak {legacy_peak / 1e6:.0f} MB | "
+          f"hashed {hashed_elapsed:.2f}s peak {hashed_peak / 1e6:.0f} MB")
+    assert legacy.sort_values("ID", kind="stable").reset_index(drop=True).equals(hashed.sort_values("ID", kind="stable").reset_index(drop=True)), "Dedup differs"
+    print("Dedup identical")
@@ -0,0 +1,27 @@
+import sys
+
+from apps.intraday_benchmark_utils import WINDOWS, load_trades, pipeline, to_compact, normalized, measure
+from src.intraday.trade_store import TradeStore
+
+# Compares the netborder and LT stats calculated from the trade frame with the ones from a TradeStore sorted once.
+# usage: benchmark_trade_store.py [number of synthetic trades | YYYY-MM-DD days]
+
+if __name__ == "__main__":
+    it = pipeline()
+    frame = to_compact(load_trades(sys.argv[1:]))
+
+    def from_frame():
+        return it.calculate_netborder(frame), it.get_xbid_stats_lt(frame, windows=WINDOWS)
+
+    def from_store():
+        store = TradeStore(frame)
+        return it.calculate_netborder(store.trades, presorted=True), it.get_xbid_stats_lt(store, windows=WINDOWS)
+
+    (frame_netborder, frame_stats), frame_elapsed, frame_peak = measure(from_frame)
+    (store_netborder, store_stats), store_elapsed, store_peak = measure(from_store)
+    print(f"   store: netborder + {len(WINDOWS)} window LT stats | frame {frame_elapsed:.2f}s peak {frame_peak / 1e6:.0f} MB | "
+          f"trade store {store_elapsed:.2f}s peak {store_peak / 1e6:.0f} MB")
+
+    for frame_result, store_result in zip([frame_netborder[0], frame_stats], [store_netborder[0], store_stats]):
+        assert normalized(frame_result).equals(normalized(store_result)), "Trade store results differ"
+    print("Trade store identical")
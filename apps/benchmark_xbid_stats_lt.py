@@ -0,0 +1,44 @@
+import datetime
+import sys
+
+import numpy as np
+import pandas as pd
+
+from apps.intraday_benchmark_utils import WINDOWS, load_trades, pipeline, to_compact, normalized, measure
+from src.intraday.intraday_trades import XBID_STATS_WINDOWS
+
+# Compares the former LT stats, a netborder per window, with the single pass ones for the default windows and for more
+# windows.
+# usage: benchmark_xbid_stats_lt.py [number of synthetic trades | YYYY-MM-DD days]
+
+
+def legacy_xbid_stats_lt(it, trades, windows):
+    trades_all = trades[trades["TRADETIMEUTC"] <= trades["DELIVERYSTARTUTC"].dt.floor('H') - datetime.timedelta(hours=1, minutes=5)]
+
+    stats = []
+    for tag, length in windows.items():
+        if length is None:
+            trades_window = trades_all
+        else:
+            trades_window = trades_all[trades_all["TRADETIMEUTC"] >= trades_all["DELIVERYSTARTUTC"].dt.floor('H') - length - datetime.timedelta(hours=1)]
+
+        _, nb_h, nb_hh, nb_qh = it.calculate_netborder(trades_window)
+        stats.append(pd.concat([nb_h, nb_hh, nb_qh], ignore_index=True).assign(TAG=tag).rename(columns={"PRICE": "AVG_PRICE"}))
+
+    return pd.concat(stats, ignore_index=True)
+
+
+if __name__ == "__main__":
+    it = pipeline()
+    frame = to_compact(load_trades(sys.argv[1:]))
+
+    for windows in (XBID_STATS_WINDOWS, WINDOWS):
+        legacy, legacy_elapsed, legacy_peak = measure(lambda: legacy_xbid_stats_lt(it, frame, windows))
+        single_pass, elapsed, peak = measure(lambda: it.get_xbid_stats_lt(frame, windows=windows))
+        print(f"LT stats: {len(windows)} windows, {len(single_pass)} rows | per window {legacy_elapsed:.2f}s peak {legacy_peak / 1e6:.0f} MB | "
+              f"single pass {elapsed:.2f}s peak {peak / 1e6:.0f} MB")
+
+        legacy, single_pass = normalized(legacy), normalized(single_pass)
+        assert legacy.drop(columns=["VOLUME", "AVG_PRICE"]).equals(single_pass.drop(columns=["VOLUME", "AVG_PRICE"])), "LT stats differ"
+        assert np.allclose(legacy[["VOLUME", "AVG_PRICE"]], single_pass[["VOLUME", "AVG_PRICE"]], rtol=1e-12, atol=0), "LT stats differ"
+    print("LT stats identical")
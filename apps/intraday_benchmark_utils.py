@@ -0,0 +1,77 @@
+import datetime
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.intraday.delivery_areas import DeliveryArea, COUNTRY_CODE_DTYPE
+from src.intraday.intraday_trades import IntradayTrades
+
+# Trades and helpers shared by the intraday benchmarks, which take [number of synthetic trades | YYYY-MM-DD days]
+
+AREAS = [DeliveryArea.BE, DeliveryArea.NL, DeliveryArea.FR, DeliveryArea.AMP, DeliveryArea.TBW, DeliveryArea.AT]
+# more LT stats windows than the default ones
+WINDOWS = {"15M": datetime.timedelta(minutes=15), "1H": datetime.timedelta(hours=1), "3H": datetime.timedelta(hours=3), "6H": datetime.timedelta(hours=6), "12H": datetime.timedelta(hours=12), "ALL": None}
+
+
+def synthetic_trades(n, days=30, seed=0):
+    rnd = np.random.default_rng(seed)
+    duration = rnd.choice([15, 30, 60], n)
+    start = pd.Timestamp("2025-01-01") + pd.to_timedelta(rnd.integers(0, days * 96, n) * 15 // duration * duration, unit="min")
+    buyer = rnd.integers(0, len(AREAS), n)
+    seller = (buyer + rnd.integers(1, len(AREAS), n)) % len(AREAS)
+
+    return pd.DataFrame({
+        "ID": np.arange(n),
+        "PRICE": np.round(rnd.normal(80, 40, n), 2).astype(str).astype(float), # decimal values, as read from the database
+        "VOLUME": (rnd.integers(1, 500, n) / 10).astype(str).astype(float),
+        "DELIVERYSTARTUTC": start,
+        "DELIVERYENDUTC": start + pd.to_timedelta(duration, unit="min"),
+        "BUYERAREA": [AREAS[i].country_iso_code for i in buyer],
+        "SELLERAREA": [AREAS[i].country_iso_code for i in seller],
+        "TRADETIMEUTC": start - pd.to_timedelta(rnd.integers(60, 24 * 3600, n), unit="s"),
+    })
+
+
+def load_trades(args, n=2_000_000):
+    # the trades of days from the database, or n synthetic ones
+    if len(args) > 1:
+        from_utc = datetime.datetime.strptime(args[0], "%Y-%m-%d")
+        return IntradayTrades(region="Belgium").get_trades(from_utc, from_utc + datetime.timedelta(days=int(args[1])))
+
+    return synthetic_trades(int(args[0]) if len(args) > 0 else n)
+
+
+def pipeline():
+    # the netborder and LT stats pipeline does not need database connections
+    it = IntradayTrades.__new__(IntradayTrades)
+    it._id_cols = ["PRICE", "VOLUME", "DELIVERYSTARTUTC", "DELIVERYENDUTC", "BUYERAREA", "SELLERAREA"]
+    return it
+
+
+def to_wide(trades):
+    return trades.astype({"PRICE": "float64", "VOLUME": "float64", "BUYERAREA": object, "SELLERAREA": object})
+
+
+def to_compact(trades):
+    return trades.astype({"PRICE": "float32", "VOLUME": "float32", "BUYERAREA": COUNTRY_CODE_DTYPE, "SELLERAREA": COUNTRY_CODE_DTYPE})
+
+
+def normalized(df):
+    # comparable regardless of row order and categorical areas
+    df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    return df.sort_values([col for col in df.columns if df[col].dtype != float]).reset_index(drop=True)
+
+
+def measure(fn):
+    # the run time without tracing, the peak allocations of a second, traced run
+    t = time.time()
+    result = fn()
+    elapsed = time.time() - t
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
@@ -7,16 +7,16 @@ from src.utils.tasks.task_orchestrator import TaskOrchestrator
 
 if __name__ == "__main__":
     tasks = [
-        LiveIntradayTradesTask(region="Belgium"),
-        LiveIntradayTradesTask(region="Netherlands"),
-        #DABorderFlowsJAO(executiontime='14:00:00'),
-        #DANetpositionsJAO(executiontime='14:01:00'),
-        #NTCJAO(executiontime='14:02:00'),
-        #ATCJAO(executiontime='14:03:00'),
+        LiveIntradayTradesTask(region="Belgium", write_behind=True),
+        LiveIntradayTradesTask(region="Netherlands", write_behind=True),
+        #DABorderFlowsJAO(executiontime='14:00:00', write_behind=True),
+        #DANetpositionsJAO(executiontime='14:01:00', write_behind=True),
+        #NTCJAO(executiontime='14:02:00', write_behind=True),
+        #ATCJAO(executiontime='14:03:00', write_behind=True),
         #UploadUKBorderFlowsRNP(frequency=15*60)
-        UploadPICASSOMOLTask(frequency=15*60),
-        UploadPICASSOExchangedVolumesTask(frequency=15*60),
-        H2HToATCTask(frequency=15 * 60),
+        UploadPICASSOMOLTask(frequency=15*60, write_behind=True),
+        UploadPICASSOExchangedVolumesTask(frequency=15*60, write_behind=True),
+        H2HToATCTask(frequency=15 * 60, write_behind=True),
     ]
 
     executor = TaskOrchestrator(tasks)
@@ -1,10 +1,7 @@
 import datetime
-
-from sqlalchemy import text
+import time
 
 from src.intraday.intraday_trades import IntradayTrades
-from src.utils.database.nxtdatabase import NXTDatabase
-import time
 
 if __name__ == "__main__":
     from_utc = datetime.datetime(2025, 1, 1)
@@ -12,16 +9,11 @@ if __name__ == "__main__":
 
     intraday_trades = IntradayTrades(region="Belgium")
 
-    dt = from_utc
-    while dt < to_utc:
-        print(dt)
-        ndt = min(dt + datetime.timedelta(days=30), to_utc)
-
-        t = time.time()
-        trades = intraday_trades.get_trades(dt, ndt)
-        print(len(trades), "trades fetched in", time.time() - t)
+    # one delivery day at a time, so memory does not grow with the range
+    t = time.time()
+    for trades in intraday_trades.iter_trades(from_utc, to_utc):
+        print(trades["DELIVERYSTARTUTC"].min(), len(trades), "trades fetched in", time.time() - t)
         stats = intraday_trades.get_xbid_stats_lt(trades)
-        intraday_trades.upload_xbid_stats(stats)
+        intraday_trades.upload_xbid_stats(stats, bulk_load=True)
         print("STATS CALCULATED", len(stats))
-
-        dt = ndt
\ No newline at end of file
+        t = time.time()
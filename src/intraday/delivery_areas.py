@@ -1,5 +1,8 @@
 from enum import Enum
 
+import numpy as np
+import pandas as pd
+
 
 class ProductTypes:
     P15MIN = "P15MIN"
@@ -121,24 +124,57 @@ class DeliveryArea(Enum):
 
     @staticmethod
     def get_delivery_area_by_id(delivery_area_id):
-        for delivery_area in DeliveryArea:
-            if delivery_area.delivery_area_id == delivery_area_id:
-                return delivery_area
-        return None
+        return _DELIVERY_AREAS_BY_ID.get(delivery_area_id)
 
     @staticmethod
     def get_delivery_area_by_eic_code(eic_code):
-        for delivery_area in DeliveryArea:
-            if delivery_area.eic_code == eic_code:
-                return delivery_area
-        return None
+        return _DELIVERY_AREAS_BY_EIC_CODE.get(eic_code)
 
     @staticmethod
     def get_delivery_area_by_area_code(area_code):
-        for delivery_area in DeliveryArea:
-            if delivery_area.area_code == area_code:
-                return delivery_area
-        return None
+        return _DELIVERY_AREAS_BY_AREA_CODE.get(area_code)
+
+    # Vectorized lookups: map a whole Series of ids/codes to an attribute of their DeliveryArea (area_code, country_iso_code, ...),
+    # every distinct value is looked up once and unknown values become NaN
+    # (with dtype, e.g. AREA_CODE_DTYPE, the result is categorical)
+    @staticmethod
+    def map_ids(ids, attribute="area_code", dtype=None):
+        return DeliveryArea._map(ids, _DELIVERY_AREAS_BY_ID, attribute, dtype)
+
+    @staticmethod
+    def map_eic_codes(eic_codes, attribute="area_code", dtype=None):
+        return DeliveryArea._map(eic_codes, _DELIVERY_AREAS_BY_EIC_CODE, attribute, dtype)
+
+    @staticmethod
+    def map_area_codes(area_codes, attribute="country_iso_code", dtype=None):
+        return DeliveryArea._map(area_codes, _DELIVERY_AREAS_BY_AREA_CODE, attribute, dtype)
+
+    @staticmethod
+    def _map(values, lookup, attribute, dtype=None):
+        codes, uniques = pd.factorize(values)
+        mapped = [getattr(lookup[value], attribute) if value in lookup else np.nan for value in uniques]
+
+        # code -1 (missing values) takes the trailing NaN / -1
+        if dtype is None:
+            return pd.Series(np.array(mapped + [np.nan], dtype=object)[codes], index=values.index, name=values.name)
+
+        category_codes = np.append(dtype.categories.get_indexer(mapped), -1)
+        return pd.Series(pd.Categorical.from_codes(category_codes[codes], dtype=dtype), index=values.index, name=values.name)
+
+
+
+# lookup indexes, the first member wins when several share a value (as the former linear scans did)
+_DELIVERY_AREAS_BY_ID = {}
+_DELIVERY_AREAS_BY_EIC_CODE = {}
+_DELIVERY_AREAS_BY_AREA_CODE = {}
+for _delivery_area in DeliveryArea:
+    _DELIVERY_AREAS_BY_ID.setdefault(_delivery_area.delivery_area_id, _delivery_area)
+    _DELIVERY_AREAS_BY_EIC_CODE.setdefault(_delivery_area.eic_code, _delivery_area)
+    _DELIVERY_AREAS_BY_AREA_CODE.setdefault(_delivery_area.area_code, _delivery_area)
+
+# fixed categories for area and country code columns, so frames from different queries share one dtype
+AREA_CODE_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(delivery_area.area_code for delivery_area in DeliveryArea)))
+COUNTRY_CODE_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(delivery_area.country_iso_code for delivery_area in DeliveryArea)))
 
 
 TSO_AREA_MAPPING = {
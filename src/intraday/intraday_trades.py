@@ -1,18 +1,35 @@
 import datetime
 from datetime import tzinfo
 
+import numpy as np
 import pandas as pd
 import pytz
 from sqlalchemy import text
 
-from src.intraday.delivery_areas import DeliveryArea
+from src.intraday.delivery_areas import DeliveryArea, AREA_CODE_DTYPE, COUNTRY_CODE_DTYPE
+from src.intraday.trade_store import TradeStore, HOUR_NS
+from src.intraday.xbid_stats import XBID_STATS, DEFAULT_XBID_STATS, calculate_partials, cumulate_partials, calculate_stats, is_incremental
 from src.utils.database.msdb_elindus import HexatradersDatabase, HexatradersDatabase_RO
 from src.utils.database.nxtdatabase import NXTDatabase
+from src.utils.database.sinks import TableSink, MultiSinkWriter
 
+# Trade frames: int64 ID, float32 PRICE/VOLUME, datetime64 delivery/trade times and categorical BUYERAREA/SELLERAREA
+# (AREA_CODE_DTYPE per source, COUNTRY_CODE_DTYPE once combined). Prices have a 0.01 EUR/MWh and volumes a 0.1 MW tick,
+# float32 holds those exactly up to TRADE_DECIMALS, aggregates are calculated in float64 on the rounded values.
+EPEX_TRADE_DTYPES = {"ID": "int64", "PRICE": "float32", "VOLUME": "float32", "DELIVERYSTARTUTC": "datetime64[ns]", "DELIVERYENDUTC": "datetime64[ns]", "TRADETIMEUTC": "datetime64[ns]"}
+NP_TRADE_DTYPES = {"ID": "int64", "PRICE": "float32", "VOLUME": "float32", "DELIVERYSTARTUTC": "datetime64[ns]", "DELIVERYENDUTC": "datetime64[ns]", "TIME": "datetime64[ns]"}
+TRADE_DECIMALS = 3
+NETBORDER_KEY_COLS = ["BUYERAREA", "SELLERAREA", "DELIVERYSTARTUTC", "DELIVERYENDUTC"]
+QUARTER_HOUR = np.timedelta64(15, "m")
+
+# products and windows (tag -> length before the hour preceding delivery, None for all trades) of the LT stats
+XBID_STATS_PRODUCTS = {"H": datetime.timedelta(minutes=60), "HH": datetime.timedelta(minutes=30), "QH": datetime.timedelta(minutes=15)}
+XBID_STATS_WINDOWS = {"1H": datetime.timedelta(hours=1), "3H": datetime.timedelta(hours=3), "6H": datetime.timedelta(hours=6), "ALL": None}
 
 class IntradayTrades:
-    def __init__(self, region):
+    def __init__(self, region, writer=None):
         self.msdb = HexatradersDatabase.get_instance()
+        self.writer = writer if writer is not None else MultiSinkWriter.get_instance()
         self.msdb_ro = HexatradersDatabase_RO.get_instance()
 
         self._id_cols = ["PRICE", "VOLUME", "DELIVERYSTARTUTC", "DELIVERYENDUTC", "BUYERAREA", "SELLERAREA"]
@@ -38,23 +55,21 @@ class IntradayTrades:
         else:
             return "traders.PUBLICTRADENORDPOOL"
 
-    def _get_epex_trades(self, from_utc, to_utc):
-        df = self.msdb_ro.query(self._epex_query + f"""
-            WHERE DELIVERYSTARTUTC >= '{from_utc.isoformat()}' AND DELIVERYENDUTC <= '{to_utc.isoformat()}'
-        """)
+    def _get_epex_trades(self, from_utc, to_utc, start_to=None):
+        # trades delivered within [from_utc, to_utc], optionally only those whose delivery starts before start_to
+        df = self.msdb_ro.query_params(self._epex_query + """
+            WHERE DELIVERYSTARTUTC >= :from_utc AND DELIVERYSTARTUTC < :start_to AND DELIVERYENDUTC <= :to_utc
+        """, {"from_utc": from_utc, "start_to": start_to or to_utc, "to_utc": to_utc}, dtypes=EPEX_TRADE_DTYPES)
 
         if len(df) == 0:
             return df
 
-        df['BUYERAREA'] = df['BUYERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_eic_code(x).area_code)
-        df['SELLERAREA'] = df['SELLERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_eic_code(x).area_code)
-
-        return df
+        return self._map_areas(df, DeliveryArea.map_eic_codes, "EPEX")
 
-    def _get_np_trades(self, from_utc, to_utc):
-        df = self.msdb_ro.query(self._np_query + f"""
-            WHERE DELIVERYSTARTUTC >= '{from_utc.isoformat()}' AND DELIVERYENDUTC <= '{to_utc.isoformat()}'
-        """)
+    def _get_np_trades(self, from_utc, to_utc, start_to=None):
+        df = self.msdb_ro.query_params(self._np_query + """
+            WHERE DELIVERYSTARTUTC >= :from_utc AND DELIVERYSTARTUTC < :start_to AND DELIVERYENDUTC <= :to_utc
+        """, {"from_utc": from_utc, "start_to": start_to or to_utc, "to_utc": to_utc}, dtypes=NP_TRADE_DTYPES)
 
         if len(df) == 0:
             return df
@@ -62,36 +77,68 @@ class IntradayTrades:
         df["TRADETIMEUTC"] = df["TIME"].dt.tz_localize(pytz.timezone('Europe/Brussels'), ambiguous="NaT").dt.tz_convert(pytz.utc).dt.tz_localize(None)
         df["TRADETIMEUTC"] = df["TRADETIMEUTC"].ffill() # fill the NaT values with the previous value
 
-        df['BUYERAREA'] = df['BUYERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_id(x).area_code)
-        df['SELLERAREA'] = df['SELLERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_id(x).area_code)
+        return self._map_areas(df, DeliveryArea.map_ids, "Nordpool").drop(columns="TIME")
+
+    def _map_areas(self, df, map_areas, source):
+        # BUYERAREA/SELLERAREA to area codes, trades with an area that is not a known DeliveryArea are dropped
+        buyer_areas = map_areas(df["BUYERAREA"], dtype=AREA_CODE_DTYPE)
+        seller_areas = map_areas(df["SELLERAREA"], dtype=AREA_CODE_DTYPE)
+
+        unknown = buyer_areas.isna() | seller_areas.isna()
+        if unknown.any():
+            codes = set(df.loc[buyer_areas.isna(), "BUYERAREA"]) | set(df.loc[seller_areas.isna(), "SELLERAREA"])
+            print(f"Dropping {unknown.sum()} {source} trades with unknown delivery areas {codes}")
+
+        df = df.assign(BUYERAREA=buyer_areas, SELLERAREA=seller_areas)
+        return df[~unknown]
+
+    def _identity_hashes(self, trades):
+        # one 64 bit hash of the identity columns per trade
+        return pd.util.hash_pandas_object(trades[self._id_cols], index=False).to_numpy()
 
-        return df.drop(columns="TIME")
+    @staticmethod
+    def _occurrences(hashes):
+        # 0 for the first trade with a hash, 1 for the second, ... (in row order)
+        order = np.argsort(hashes, kind="stable")
+        sorted_hashes = hashes[order]
 
-    def _add_occurrence_counter(self, trades):
-        trades['OCCURRENCES'] = trades.groupby(self._id_cols).cumcount()+1
+        positions = np.arange(len(hashes))
+        run_starts = np.maximum.accumulate(np.where(np.r_[True, sorted_hashes[1:] != sorted_hashes[:-1]], positions, 0))
+
+        occurrences = np.empty(len(hashes), dtype=np.int64)
+        occurrences[order] = positions - run_starts
+        return occurrences
 
     def _concat_unique(self, epex_trades, np_trades):
-        np_trades_ind = np_trades.set_index(self._id_cols + ["OCCURRENCES"])
-        epex_trades_ind = epex_trades.set_index(self._id_cols + ["OCCURRENCES"])
+        # A trade published by both exchanges is kept once: the n-th nordpool trade with a given identity is dropped
+        # if epex has at least n trades with that identity
+        epex_hashes, epex_counts = np.unique(self._identity_hashes(epex_trades), return_counts=True)
+        np_hashes = self._identity_hashes(np_trades)
+
+        # number of epex trades with the identity of each nordpool trade
+        positions = np.searchsorted(epex_hashes, np_hashes)
+        found = positions < len(epex_hashes)
+        found[found] = epex_hashes[positions[found]] == np_hashes[found]
 
-        np_trades_ind = np_trades_ind[~np_trades_ind.index.isin(epex_trades_ind.index)]
+        in_epex = np.zeros(len(np_hashes), dtype=np.int64)
+        in_epex[found] = epex_counts[positions[found]]
+
+        np_trades = np_trades[self._occurrences(np_hashes) >= in_epex]
 
         if len(epex_trades) == 0:
-            return np_trades_ind.reset_index() # bugfix if epex is empty, otherwise column types are messed up
+            return np_trades.reset_index(drop=True)
 
-        return pd.concat([epex_trades, np_trades_ind.reset_index()], ignore_index=True)
+        return pd.concat([epex_trades, np_trades], ignore_index=True)
 
     def combine_trades(self, epex_trades, np_trades):
-        self._add_occurrence_counter(epex_trades)
-        self._add_occurrence_counter(np_trades)
+        return self._to_country_areas(self._concat_unique(epex_trades, np_trades))
 
-        combined = self._concat_unique(epex_trades, np_trades).drop(columns="OCCURRENCES")
-        combined["BUYERAREA"] = combined["BUYERAREA"].apply(
-            lambda x: DeliveryArea.get_delivery_area_by_area_code(x).country_iso_code)
-        combined["SELLERAREA"] = combined["SELLERAREA"].apply(
-            lambda x: DeliveryArea.get_delivery_area_by_area_code(x).country_iso_code)
+    @staticmethod
+    def _to_country_areas(trades):
+        trades["BUYERAREA"] = DeliveryArea.map_area_codes(trades["BUYERAREA"], dtype=COUNTRY_CODE_DTYPE)
+        trades["SELLERAREA"] = DeliveryArea.map_area_codes(trades["SELLERAREA"], dtype=COUNTRY_CODE_DTYPE)
 
-        return combined
+        return trades
 
     def get_trades(self, from_utc, to_utc):
         epex_trades = self._get_epex_trades(from_utc, to_utc)
@@ -99,33 +146,110 @@ class IntradayTrades:
 
         return self.combine_trades(epex_trades, np_trades)
 
-    def calculate_netborder(self, trades):
-        trades = trades.copy()
+    def iter_trades(self, from_utc, to_utc, chunk_length=datetime.timedelta(days=1)):
+        # get_trades in chunks of delivery start, so memory is bounded by chunk_length instead of the whole range.
+        # Every trade falls in exactly one chunk and stats group per delivery period, so they can be calculated per
+        # chunk (the netborder per quarter-hour also needs the blocks of earlier chunks, see iter_netborder).
+        # Empty chunks are skipped.
+        for _, _, trades in self._iter_chunks(from_utc, to_utc, chunk_length):
+            if trades is not None:
+                yield trades
+
+    def _iter_chunks(self, from_utc, to_utc, chunk_length):
+        # (chunk_from, chunk_to, trades delivered from chunk_from and before chunk_to) with None for an empty chunk
+        chunk_from = from_utc
+        while chunk_from < to_utc:
+            chunk_to = min(chunk_from + chunk_length, to_utc)
+
+            epex_trades = self._get_epex_trades(chunk_from, to_utc, start_to=chunk_to)
+            np_trades = self._get_np_trades(chunk_from, to_utc, start_to=chunk_to)
+
+            if len(epex_trades) > 0 or len(np_trades) > 0:
+                yield chunk_from, chunk_to, self.combine_trades(epex_trades, np_trades)
+            else:
+                yield chunk_from, chunk_to, None
+
+            chunk_from = chunk_to
+
+    def iter_netborder(self, from_utc, to_utc, chunk_length=datetime.timedelta(days=1)):
+        # calculate_netborder per chunk of iter_trades, with only the quarter-hours delivered within the chunk. A block
+        # delivered past the end of its chunk is carried over (aggregated) to the next chunks, so every quarter-hour is
+        # calculated once from all products delivering it and the upserts of consecutive chunks don't overwrite each other.
+        carried = None
+        for chunk_from, chunk_to, trades in self._iter_chunks(from_utc, to_utc, chunk_length):
+            if trades is None and carried is None:
+                continue
+
+            print(chunk_from, 0 if trades is None else len(trades), "TRADES FETCHED")
+            aggregates = [df for df in (carried, None if trades is None else self._aggregate_trades(trades)) if df is not None]
+            aggregates = aggregates[0] if len(aggregates) == 1 else pd.concat(aggregates, ignore_index=True)
+
+            yield self._netborder_from_aggregates(aggregates, delivery_from=chunk_from, delivery_to=chunk_to)
+
+            carried = aggregates[aggregates["DELIVERYENDUTC"] > chunk_to]
+            carried = carried if len(carried) > 0 else None
+
+    @staticmethod
+    def _to_float64(values):
+        return np.round(values.to_numpy(dtype="float64"), TRADE_DECIMALS)
+
+    def _volprice_trades(self, trades):
+        # only the columns that are aggregated, prices and volumes in float64
+        trades = trades[["BUYERAREA", "SELLERAREA", "DELIVERYSTARTUTC", "DELIVERYENDUTC", "TRADETIMEUTC"]].assign(
+            PRICE=self._to_float64(trades["PRICE"]), VOLUME=self._to_float64(trades["VOLUME"]))
         trades["VOLPRICE"] = trades["VOLUME"] * trades["PRICE"]
+        return trades
+
+    def _aggregate_trades(self, trades, presorted=False):
+        # VOLPRICE, VOLUME and LAST_PRICE per delivery period and border
+        trades = self._volprice_trades(trades)
+        if not presorted:
+            trades = trades.sort_values(by='TRADETIMEUTC', kind="stable")
 
-        trades_grouped = trades.sort_values(by='TRADETIMEUTC').groupby(["BUYERAREA", "SELLERAREA", "DELIVERYSTARTUTC", "DELIVERYENDUTC"]).agg({
+        return trades.groupby(NETBORDER_KEY_COLS, observed=True).agg({
             "VOLPRICE": "sum",
             "VOLUME": "sum",
             "PRICE": "last",
         }).reset_index().rename(columns={"PRICE": "LAST_PRICE"})
 
+    def calculate_netborder(self, trades, presorted=False):
+        # presorted: the trades of every border and delivery period are in trade time order, as in TradeStore.trades
+        return self._netborder_from_aggregates(self._aggregate_trades(trades, presorted=presorted))
+
+    @staticmethod
+    def _expand_to_quarter_hours(products):
+        # One row per quarter-hour delivered by each product: every row is repeated by its number of quarter-hours and
+        # its delivery start shifted by 0, 15, 30, ... minutes. Products that are not a multiple of 15 minutes are left out.
+        duration = (products["DELIVERYENDUTC"] - products["DELIVERYSTARTUTC"]).to_numpy()
+        quarters = np.where(duration % QUARTER_HOUR == np.timedelta64(0), np.maximum(duration // QUARTER_HOUR, 0), 0)
+
+        rows = np.repeat(np.arange(len(products)), quarters)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(quarters) - quarters, quarters)
+
+        expanded = products[["BUYERAREA", "SELLERAREA", "VOLPRICE", "VOLUME"]].iloc[rows]
+        expanded.insert(0, "DELIVERYSTARTUTC", products["DELIVERYSTARTUTC"].to_numpy()[rows] + offsets * QUARTER_HOUR)
+        return expanded
+
+    @staticmethod
+    def _delivered_within(df, delivery_from=None, delivery_to=None):
+        # the rows with a delivery start within [delivery_from, delivery_to), None for no bound
+        if delivery_from is not None:
+            df = df[df["DELIVERYSTARTUTC"] >= delivery_from]
+        if delivery_to is not None:
+            df = df[df["DELIVERYSTARTUTC"] < delivery_to]
+        return df
+
+    def _netborder_from_aggregates(self, trades_grouped, delivery_from=None, delivery_to=None):
+        # delivery_from/delivery_to: only the quarter-hours and the products starting within them, products starting
+        # earlier still add to the quarter-hours they deliver within them
+        expanded = self._delivered_within(self._expand_to_quarter_hours(trades_grouped), delivery_from, delivery_to)
+        trades_grouped = self._delivered_within(trades_grouped, delivery_from, delivery_to)
+
         netborder_q = trades_grouped[trades_grouped["DELIVERYENDUTC"] - trades_grouped["DELIVERYSTARTUTC"] == datetime.timedelta(minutes=15)].set_index("DELIVERYSTARTUTC")
         netborder_hh = trades_grouped[trades_grouped["DELIVERYENDUTC"] - trades_grouped["DELIVERYSTARTUTC"] == datetime.timedelta(minutes=30)].set_index("DELIVERYSTARTUTC")
         netborder_h = trades_grouped[trades_grouped["DELIVERYENDUTC"] - trades_grouped["DELIVERYSTARTUTC"] == datetime.timedelta(minutes=60)].set_index("DELIVERYSTARTUTC")
 
-        netborder_hh2 = netborder_hh.copy()
-        netborder_hh2.index += datetime.timedelta(minutes=15)
-
-        netborder_h2 = netborder_h.copy()
-        netborder_h2.index += datetime.timedelta(minutes=15)
-
-        netborder_h3 = netborder_h.copy()
-        netborder_h3.index += datetime.timedelta(minutes=30)
-
-        netborder_h4 = netborder_h.copy()
-        netborder_h4.index += datetime.timedelta(minutes=45)
-
-        netborder = pd.concat([netborder_q, netborder_hh, netborder_hh2, netborder_h, netborder_h2, netborder_h3, netborder_h4]).groupby(["DELIVERYSTARTUTC", "BUYERAREA", "SELLERAREA"]).agg({
+        netborder = expanded.groupby(["DELIVERYSTARTUTC", "BUYERAREA", "SELLERAREA"], observed=True).agg({
             "VOLPRICE": "sum",
             "VOLUME": "sum",
         }).reset_index()
@@ -145,55 +269,94 @@ class IntradayTrades:
 
         return netborder.drop(columns="VOLPRICE").rename(columns={"DELIVERYSTARTUTC": "UTCTIME"}), netborder_h, netborder_hh, netborder_q
 
-    def upload_netborder(self, netborder, netborder_h=None, netborder_hh=None, netborder_q=None):
+    def upload_netborder(self, netborder, netborder_h=None, netborder_hh=None, netborder_q=None, bulk_load=False, on_written=None, on_failed=None):
+        # on_written/on_failed: see MultiSinkWriter.write_many
         if len(netborder) == 0:
             return
 
-        print("AMPLIFINO UPLOAD")
-        NXTDatabase.energy().bulk_upsert(netborder, "XBID_TRADES", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA"], data_cols=["VOLUME", "PRICE"], moddate_col="CREATIONDATE")
-
-        # Upload to smart
-        print("SMART UPLOAD")
-        self._upload_to_smart(netborder, netborder_h, netborder_hh, netborder_q)
-
-    def _upload_to_smart(self, netborder, netborder_h=None, netborder_hh=None, netborder_qh=None):
-        HexatradersDatabase.get_instance().bulk_upsert(df=netborder, table="traders.XBID_TRADES", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA"], data_cols=["VOLUME", "PRICE"], moddate_col="CREATIONDATE")
-        if netborder_h is not None and len(netborder_h)>0:
-            HexatradersDatabase.get_instance().bulk_upsert(netborder_h, "traders.XBID_TRADES_PER_PRODUCT", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA","PRODUCTTYPE"], data_cols=["VOLUME", "PRICE"], moddate_col="CREATIONDATE")
-        if netborder_hh is not None and len(netborder_hh)>0:
-            HexatradersDatabase.get_instance().bulk_upsert(netborder_hh, "traders.XBID_TRADES_PER_PRODUCT", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA","PRODUCTTYPE"], data_cols=["VOLUME", "PRICE"], moddate_col="CREATIONDATE")
-        if netborder_qh is not None and len(netborder_qh)>0:
-            HexatradersDatabase.get_instance().bulk_upsert(netborder_qh, "traders.XBID_TRADES_PER_PRODUCT", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA","PRODUCTTYPE"], data_cols=["VOLUME", "PRICE"], moddate_col="CREATIONDATE")
-
-    def _filter_xbid_trades(self, trades, dt):
-        mask_in_range = trades["TRADETIMEUTC"] >= trades["DELIVERYSTARTUTC"].dt.floor('H') - dt - datetime.timedelta(hours=1)
-        #mask_recent = trades["TRADETIMEUTC"] >= datetime.datetime.now(pytz.utc).replace(tzinfo=None) - dt
-
-        return trades[mask_in_range].copy()
-
-    def _get_xbid_stats_from_trades(self, tag, trades):
-        _, nb_h, nb_hh, nb_qh = self.calculate_netborder(trades)
-        nb = pd.concat([nb_h, nb_hh, nb_qh], ignore_index=True)
-        nb["TAG"] = tag
-        return nb.rename(columns={"PRICE": "AVG_PRICE"})
-
-    def get_xbid_stats_lt(self, trades):
-        # trades before lt trades
-        trades_all = trades[trades["TRADETIMEUTC"] <= trades["DELIVERYSTARTUTC"].dt.floor('H') - datetime.timedelta(hours=1, minutes=5)].copy()
-
-        trades_1h = self._filter_xbid_trades(trades_all, datetime.timedelta(hours=1))
-        trades_3h = self._filter_xbid_trades(trades_all, datetime.timedelta(hours=3))
-        trades_6h = self._filter_xbid_trades(trades_all, datetime.timedelta(hours=6))
-
-        stats_1h = self._get_xbid_stats_from_trades("1H", trades_1h)
-        stats_3h = self._get_xbid_stats_from_trades("3H", trades_3h)
-        stats_6h = self._get_xbid_stats_from_trades("6H", trades_6h)
-        stats_all = self._get_xbid_stats_from_trades("ALL", trades_all)
-
-        return pd.concat([stats_1h, stats_3h, stats_6h, stats_all], ignore_index=True)
-
-    def upload_xbid_stats(self, netborder):
-        NXTDatabase.energy().bulk_upsert(netborder, "XBID_STATS", key_cols=["UTCTIME", "PRODUCTTYPE", "TAG", "BUYERAREA", "SELLERAREA"], data_cols=["VOLUME", "AVG_PRICE", "LAST_PRICE"], moddate_col="CREATIONDATE")
+        # Amplifino and smart are written in parallel, the per product frames as one upsert
+        print("AMPLIFINO AND SMART UPLOAD")
+        writes = [
+            (TableSink(NXTDatabase.energy(), "XBID_TRADES", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA"], data_cols=["VOLUME", "PRICE"], bulk_load=bulk_load), netborder),
+            (TableSink(HexatradersDatabase.get_instance(), "traders.XBID_TRADES", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA"], data_cols=["VOLUME", "PRICE"]), netborder),
+        ]
+
+        per_product = [nb for nb in (netborder_h, netborder_hh, netborder_q) if nb is not None and len(nb) > 0]
+        if len(per_product) > 0:
+            writes.append((TableSink(HexatradersDatabase.get_instance(), "traders.XBID_TRADES_PER_PRODUCT", key_cols=["UTCTIME", "BUYERAREA", "SELLERAREA", "PRODUCTTYPE"], data_cols=["VOLUME", "PRICE"]), pd.concat(per_product, ignore_index=True)))
+
+        self.writer.write_many(writes, on_written=on_written, on_failed=on_failed)
+
+    @staticmethod
+    def _window_tags(windows):
+        # tags from the tightest window to the widest, a trade's bucket is the index of the tightest window it falls in
+        return sorted(windows, key=lambda tag: (windows[tag] is None, windows[tag]))
+
+    def _lt_trades(self, store, windows, weights=None):
+        # The trades of a TradeStore done at least 5 minutes before the hour preceding the delivery hour (long term) of
+        # the stats products, with their window BUCKET, LEAD_HOURS and WEIGHT (see xbid_stats; weights in store order).
+        # Per delivery hour the trades of a bucket are the slice between the start of its window and of the next tighter one.
+        tags = self._window_tags(windows)
+
+        rows, buckets = [], []
+        end = store.end_rows(HOUR_NS + 5 * 60 * 10 ** 9)
+        for bucket, tag in enumerate(tags):
+            begin = store.first_rows(None if windows[tag] is None else HOUR_NS + int(windows[tag].total_seconds()) * 10 ** 9)
+            rows.append(store.rows(begin, end))
+            buckets.append(np.full(len(rows[-1]), bucket, dtype=np.int8))
+            end = np.minimum(begin, end)
+
+        rows, buckets = np.concatenate(rows), np.concatenate(buckets)
+        durations = store.column("DELIVERYENDUTC", rows) - store.column("DELIVERYSTARTUTC", rows)
+        products = np.isin(durations, np.array(list(XBID_STATS_PRODUCTS.values()), dtype="timedelta64[ns]"))
+        rows, buckets = rows[products], buckets[products]
+
+        trades = store.take(rows, NETBORDER_KEY_COLS + ["TRADETIMEUTC", "PRICE", "VOLUME"])
+        trades["PRICE"] = self._to_float64(trades["PRICE"])
+        trades["VOLUME"] = self._to_float64(trades["VOLUME"])
+        trades["WEIGHT"] = 1.0 if weights is None else weights[rows]
+        trades["LEAD_HOURS"] = (store.lead_times(rows) - HOUR_NS) / HOUR_NS
+        trades["BUCKET"] = buckets
+        return trades
+
+    def get_xbid_stats_lt(self, trades, windows=XBID_STATS_WINDOWS, stats=DEFAULT_XBID_STATS):
+        # LT stats (see xbid_stats) per window of the last 1H, 3H, ... before the hour preceding delivery (None = all
+        # LT trades), from the partials of one group-by per border, delivery period and tightest window.
+        # trades: a trade frame or a TradeStore of them
+        store = trades if isinstance(trades, TradeStore) else TradeStore(trades)
+        lt_trades = self._lt_trades(store, windows)
+        del store # freed before the group-by if sorted here
+        partials = calculate_partials(lt_trades, stats, NETBORDER_KEY_COLS + ["BUCKET"], presorted=True)
+
+        return self._xbid_stats_from_partials(partials, windows, stats, lt_trades)
+
+    def _xbid_stats_from_partials(self, partials, windows, stats, lt_trades=None):
+        columns = ["UTCTIME", "BUYERAREA", "SELLERAREA", "DELIVERYENDUTC"] + list(stats) + ["PRODUCTTYPE", "TAG"]
+        if len(partials) == 0:
+            return pd.DataFrame(columns=columns)
+
+        tags = self._window_tags(windows)
+        product_types = {duration: product_type for product_type, duration in XBID_STATS_PRODUCTS.items()}
+
+        if is_incremental(stats):
+            lt_trades = None # only the partials are needed
+        elif lt_trades is not None:
+            lt_trades = lt_trades.sort_values(by="PRICE", kind="stable") # the quantiles of every window sort on price
+
+        stats_windows = []
+        for bucket, window_partials in cumulate_partials(partials, stats, pd.RangeIndex(len(tags))).items():
+            window_trades = None if lt_trades is None else lt_trades[lt_trades["BUCKET"] <= bucket]
+            stats_window = calculate_stats(window_partials, stats, window_trades, NETBORDER_KEY_COLS).reset_index()
+
+            stats_window["PRODUCTTYPE"] = (stats_window["DELIVERYENDUTC"] - stats_window["DELIVERYSTARTUTC"]).map(product_types)
+            stats_window["TAG"] = tags[bucket]
+            stats_windows.append(stats_window)
+
+        return pd.concat(stats_windows, ignore_index=True).rename(columns={"DELIVERYSTARTUTC": "UTCTIME"})[columns]
+
+    def upload_xbid_stats(self, netborder, bulk_load=False, on_written=None, on_failed=None):
+        self.writer.write(netborder, [TableSink(NXTDatabase.energy(), "XBID_STATS", key_cols=["UTCTIME", "PRODUCTTYPE", "TAG", "BUYERAREA", "SELLERAREA"], data_cols=[col for col in netborder.columns if col in XBID_STATS], bulk_load=bulk_load)],
+                          on_written=on_written, on_failed=on_failed)
 
 
 if __name__ == "__main__":
@@ -1,42 +1,57 @@
 import datetime
 
+import numpy as np
 import pandas as pd
 import pytz
 from sqlalchemy import text
 
 from src.intraday.delivery_areas import DeliveryArea
-from src.intraday.intraday_trades import IntradayTrades
+from src.intraday.intraday_trades import IntradayTrades, EPEX_TRADE_DTYPES, NP_TRADE_DTYPES, NETBORDER_KEY_COLS, XBID_STATS_WINDOWS
+from src.intraday.trade_buffer import TradeBuffer
+from src.intraday.trade_store import TradeStore
+from src.intraday.xbid_stats import DEFAULT_XBID_STATS, calculate_partials, merge_partials, is_incremental
 from src.utils.database.msdb_elindus import HexatradersDatabase
 from src.utils.database.nxtdatabase import NXTDatabase
 
 
 class LiveIntradayTrades(IntradayTrades):
-    def __init__(self, region):
-        super().__init__(region)
+    def __init__(self, region, writer=None, lt_stats=DEFAULT_XBID_STATS, lt_windows=XBID_STATS_WINDOWS):
+        super().__init__(region, writer=writer)
+
+        self.lt_stats = lt_stats
+        self.lt_windows = lt_windows
 
         self._epex_id = None
         self._np_id = None
 
-        self._epex_df = None
-        self._np_df = None
+        # the trades per source from _from_utc, combined on read only
+        self._epex_trades = TradeBuffer()
+        self._np_trades = TradeBuffer()
+
+        # Running netborder aggregates of the buffered trades, so a poll only aggregates the new trades:
+        # identity hash -> [delivery start (ns), epex count, nordpool count] and a frame of VOLPRICE, VOLUME,
+        # LAST_TIME and LAST_PRICE indexed by NETBORDER_KEY_COLS
+        self._identities = {}
+        self._aggregates = None
+        self._from_utc = None
+
+        # and the partials of the LT stats per border, delivery period and window bucket (if they are all incremental)
+        self._lt_partials = None
 
     def _get_new_epex_trades(self, id_from):
-        df = self.msdb_ro.query(self._epex_query + f"""
-            WHERE ID > '{id_from}'
-        """)
+        df = self.msdb_ro.query_params(self._epex_query + """
+            WHERE ID > :id_from
+        """, {"id_from": id_from}, dtypes=EPEX_TRADE_DTYPES)
 
         if len(df) == 0:
             return None
 
-        df['BUYERAREA'] = df['BUYERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_eic_code(x).area_code)
-        df['SELLERAREA'] = df['SELLERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_eic_code(x).area_code)
-
-        return df
+        return self._map_areas(df, DeliveryArea.map_eic_codes, "EPEX")
 
     def _get_new_np_trades(self, id_from):
-        df = self.msdb_ro.query(self._np_query + f"""
-            WHERE ID > '{id_from}'
-        """)
+        df = self.msdb_ro.query_params(self._np_query + """
+            WHERE ID > :id_from
+        """, {"id_from": id_from}, dtypes=NP_TRADE_DTYPES)
 
         if len(df) == 0:
             return None
@@ -45,41 +60,144 @@ class LiveIntradayTrades(IntradayTrades):
                                                        ambiguous="NaT").dt.tz_convert(pytz.utc).dt.tz_localize(None)
         df["TRADETIMEUTC"] = df["TRADETIMEUTC"].ffill()  # fill the NaT values with the previous value
 
-        df['BUYERAREA'] = df['BUYERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_id(x).area_code)
-        df['SELLERAREA'] = df['SELLERAREA'].apply(lambda x: DeliveryArea.get_delivery_area_by_id(x).area_code)
-
-        return df.drop(columns="TIME")
+        return self._map_areas(df, DeliveryArea.map_ids, "Nordpool").drop(columns="TIME")
 
     def update(self):
         from_utc = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(days=1)
         to_utc = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)  + datetime.timedelta(days=1)
 
-        if self._epex_id is None or self._epex_id is None:
+        self._evict(from_utc)
+
+        if self._epex_id is None:
             new_epex = self._get_epex_trades(from_utc=from_utc, to_utc=to_utc)
-            if new_epex is not None:
-                self._epex_df = new_epex
         else:
-            old_df = self._epex_df[self._epex_df["DELIVERYSTARTUTC"] >= from_utc]
-            self._epex_df = pd.concat([old_df, self._get_new_epex_trades(self._epex_id)])
+            new_epex = self._get_new_epex_trades(self._epex_id)
+        self._epex_id = self._last_id(self._epex_id, new_epex)
+        new_epex = self._in_window(new_epex, from_utc)
+        self._epex_trades.append(new_epex)
 
-        if len(self._epex_df) > 0:
-            self._epex_id = self._epex_df["ID"].max()
-
-        if self._np_df is None or self._np_id is None:
+        if self._np_id is None:
             new_np = self._get_np_trades(from_utc=from_utc, to_utc=to_utc)
-            if new_np is not None:
-                self._np_df = new_np
         else:
-            old_df = self._np_df[self._np_df["DELIVERYSTARTUTC"] >= from_utc]
-            self._np_df = pd.concat([old_df, self._get_new_np_trades(self._np_id)])
-
-        if len(self._np_df) > 0:
-            self._np_id = self._np_df["ID"].max()
-
-    def get_live_trades(self):
-        self.update()
-
-        trades = self.combine_trades(epex_trades=self._epex_df, np_trades=self._np_df)
+            new_np = self._get_new_np_trades(self._np_id)
+        self._np_id = self._last_id(self._np_id, new_np)
+        new_np = self._in_window(new_np, from_utc)
+        self._np_trades.append(new_np)
+
+        self._add_to_aggregates(new_epex if new_epex is not None else self._epex_trades.empty_frame(),
+                                new_np if new_np is not None else self._np_trades.empty_frame())
+
+    @staticmethod
+    def _in_window(new_trades, from_utc):
+        # new trades delivered before the window are neither buffered nor aggregated
+        if new_trades is None:
+            return None
+        return new_trades[new_trades["DELIVERYSTARTUTC"] >= from_utc]
+
+    @staticmethod
+    def _last_id(last_id, new_trades):
+        # the highest trade ID fetched so far, from the new trades only
+        if new_trades is None or len(new_trades) == 0:
+            return last_id
+        return new_trades["ID"].max() if last_id is None else max(last_id, new_trades["ID"].max())
+
+    def _evict(self, from_utc):
+        # the delivery periods before from_utc, once per hour: whole delivery days from the buffers, the trades of the
+        # day of from_utc before it are filtered on read
+        if from_utc == self._from_utc:
+            return
+        self._from_utc = from_utc
+
+        self._epex_trades.evict(from_utc)
+        self._np_trades.evict(from_utc)
+
+        if self._aggregates is not None:
+            self._aggregates = self._aggregates[self._aggregates.index.get_level_values("DELIVERYSTARTUTC") >= from_utc]
+        if self._lt_partials is not None:
+            self._lt_partials = self._lt_partials[self._lt_partials.index.get_level_values("DELIVERYSTARTUTC") >= from_utc]
+
+        cutoff = pd.Timestamp(from_utc).value
+        self._identities = {h: entry for h, entry in self._identities.items() if entry[0] >= cutoff}
+
+    def _count_identities(self, hashes):
+        # epex and nordpool counts so far of the identity of every trade
+        unique, inverse = np.unique(hashes, return_inverse=True)
+        counts = np.array([self._identities.get(h, (0, 0, 0))[1:] for h in unique.tolist()], dtype=np.int64).reshape(-1, 2)
+        return counts[inverse, 0], counts[inverse, 1]
+
+    def _add_identities(self, hashes, trades, source):
+        unique, first, counts = np.unique(hashes, return_index=True, return_counts=True)
+        starts = trades["DELIVERYSTARTUTC"].to_numpy().astype("int64")[first]
+        for h, start, count in zip(unique.tolist(), starts.tolist(), counts.tolist()):
+            self._identities.setdefault(h, [start, 0, 0])[source] += count
+
+    def _add_to_aggregates(self, epex_trades, np_trades):
+        # Folds the new trades into the aggregates as combine_trades would count them: an identity is combined
+        # max(epex count, nordpool count) times. An epex trade matching a nordpool trade seen before replaces it: it
+        # adds no volume, but its trade time can still make its price the last one. For the LT stats the replaced trade
+        # keeps its window bucket and lead time, which only differ if the exchanges report different trade times.
+        epex_hashes = self._identity_hashes(epex_trades)
+        in_epex, in_np = self._count_identities(epex_hashes)
+        epex_weight = (in_epex + self._occurrences(epex_hashes) >= in_np).astype("float64")
+        self._add_identities(epex_hashes, epex_trades, 1)
+
+        np_hashes = self._identity_hashes(np_trades)
+        in_epex, in_np = self._count_identities(np_hashes)
+        np_new = in_np + self._occurrences(np_hashes) >= in_epex
+        self._add_identities(np_hashes, np_trades, 2)
+
+        if len(epex_trades) + np_new.sum() == 0:
+            return
+
+        # sorted once by delivery hour and trade time for both the LT partials and the aggregates
+        store = TradeStore(self._to_country_areas(pd.concat([df for df in (epex_trades, np_trades[np_new]) if len(df) > 0], ignore_index=True)))
+        weights = np.r_[epex_weight, np.ones(np_new.sum())][store.order]
+
+        if is_incremental(self.lt_stats):
+            lt_trades = self._lt_trades(store, self.lt_windows, weights)
+            lt_partials = [calculate_partials(lt_trades, self.lt_stats, NETBORDER_KEY_COLS + ["BUCKET"], presorted=True)]
+            if self._lt_partials is not None:
+                lt_partials.insert(0, self._lt_partials)
+            self._lt_partials = merge_partials(lt_partials, self.lt_stats)
+
+        new_trades = self._volprice_trades(store.trades)
+        new_trades["VOLUME"] *= weights
+        new_trades["VOLPRICE"] *= weights
+
+        aggregates = [new_trades.groupby(NETBORDER_KEY_COLS, observed=True).agg(
+            VOLPRICE=("VOLPRICE", "sum"), VOLUME=("VOLUME", "sum"), LAST_TIME=("TRADETIMEUTC", "last"), LAST_PRICE=("PRICE", "last"))]
+        if self._aggregates is not None:
+            aggregates.insert(0, self._aggregates)
+
+        # on equal trade times the newer trade has the last price
+        self._aggregates = pd.concat(aggregates).sort_values(by="LAST_TIME", kind="stable").groupby(level=NETBORDER_KEY_COLS, observed=True).agg(
+            {"VOLPRICE": "sum", "VOLUME": "sum", "LAST_TIME": "last", "LAST_PRICE": "last"})
+
+    def get_live_netborder(self, update=True):
+        # calculate_netborder of get_live_trades, from the running aggregates
+        if update:
+            self.update()
+
+        if self._aggregates is None:
+            return self.calculate_netborder(self.get_live_trades(update=False))
+
+        return self._netborder_from_aggregates(self._aggregates.drop(columns="LAST_TIME").reset_index())
+
+    def get_live_xbid_stats_lt(self, update=True):
+        # get_xbid_stats_lt of get_live_trades, from the running partials unless a stat needs all trades
+        if update:
+            self.update()
+
+        if self._lt_partials is None:
+            return self.get_xbid_stats_lt(self.get_live_trades(update=False), windows=self.lt_windows, stats=self.lt_stats)
+
+        return self._xbid_stats_from_partials(self._lt_partials, self.lt_windows, self.lt_stats)
+
+    def get_live_trades(self, update=True):
+        if update:
+            self.update()
+
+        trades = self.combine_trades(epex_trades=self._epex_trades.to_frame(self._from_utc), np_trades=self._np_trades.to_frame(self._from_utc))
 
         return trades
 
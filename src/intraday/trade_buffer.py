@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+DAY_NS = 24 * 3600 * 10 ** 9
+MAX_DAY_CHUNKS = 60 # appended chunks of a delivery day concatenated into one, an hour of polls
+
+
+class TradeBuffer:
+    # The trades of one source as append-only chunks per delivery day (UTC). Appending a poll's trades only splits
+    # them over their delivery days and copies none of the trades kept, and a day leaving the window is dropped whole.
+    # Every MAX_DAY_CHUNKS appended chunks of a day are concatenated once, so a day has few chunks to read.
+    def __init__(self):
+        self._days = {} # delivery day (ns) -> (concatenated chunks, appended chunks)
+        self._empty = None
+
+    def __len__(self):
+        return sum(len(chunk) for day in self._days for chunk in self._chunks(day))
+
+    def _chunks(self, day):
+        concatenated, appended = self._days[day]
+        return concatenated + appended
+
+    def append(self, trades):
+        if trades is None:
+            return
+        if self._empty is None:
+            self._empty = trades.iloc[:0]
+        if len(trades) == 0:
+            return
+
+        start = trades["DELIVERYSTARTUTC"].to_numpy().view("int64")
+        day = start - start % DAY_NS
+        days = np.unique(day)
+        for value in days.tolist():
+            concatenated, appended = self._days.setdefault(value, ([], []))
+            appended.append(trades if len(days) == 1 else trades[day == value])
+            if len(appended) == MAX_DAY_CHUNKS:
+                concatenated.append(pd.concat(appended))
+                appended.clear()
+
+    def empty_frame(self):
+        # no trades, with the columns and dtypes of the appended ones
+        return self._empty
+
+    def evict(self, from_utc):
+        # drops the days delivered before from_utc, the trades of its own day before it are dropped by to_frame
+        cutoff = pd.Timestamp(from_utc).value
+        self._days = {day: chunks for day, chunks in self._days.items() if day + DAY_NS > cutoff}
+
+    def to_frame(self, from_utc=None):
+        # the trades delivered from from_utc, in append order per delivery day
+        chunks = [chunk for day in sorted(self._days) for chunk in self._chunks(day)]
+        if len(chunks) == 0:
+            return self.empty_frame()
+
+        trades = pd.concat(chunks)
+        if from_utc is not None:
+            trades = trades[trades["DELIVERYSTARTUTC"] >= from_utc]
+        return trades
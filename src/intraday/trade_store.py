@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+HOUR_NS = 3600 * 10 ** 9
+
+
+class TradeStore:
+    # Trades sorted once by delivery hour and trade time (stable, trades without trade time last). The trades of a
+    # border and delivery period are then in trade time order, so "last" aggregates need no sort, and the trades of a
+    # delivery hour within a lead time range are a slice: key = hour index * span + (trade time - delivery hour) is
+    # increasing, so the slices of all hours are found with one searchsorted.
+    def __init__(self, trades):
+        start = trades["DELIVERYSTARTUTC"].to_numpy().view("int64")
+        trade_time = trades["TRADETIMEUTC"].to_numpy().view("int64")
+        no_trade_time = trades["TRADETIMEUTC"].isna().to_numpy()
+
+        hour = start - start % HOUR_NS
+        relative = trade_time - hour
+        # trades without trade time after the others of their hour, with a lead time <= 0
+        if no_trade_time.any():
+            relative[no_trade_time] = max(relative[~no_trade_time].max() + 1, 0) if not no_trade_time.all() else 0
+
+        self._min = int(relative.min()) if len(trades) > 0 else 0
+        self._span = int(relative.max()) - self._min + 2 if len(trades) > 0 else 1 # + 1 for the end of an hour
+        index = (hour - hour.min()) // HOUR_NS if len(trades) > 0 else hour
+        if len(trades) > 0 and (int(index.max()) + 1) * self._span >= 2 ** 63:
+            index = np.unique(hour, return_inverse=True)[1] # hours far apart: rank them
+            if (int(index.max()) + 1) * self._span >= 2 ** 63:
+                raise Exception("TradeStore: trade times too far from their delivery hours for int64 keys")
+
+        keys = index * self._span + (relative - self._min)
+        self.order = np.argsort(keys, kind="stable")
+        self._trades, self._sorted = trades, None
+        self._keys, self._relative = keys[self.order], relative[self.order]
+
+        hour, index = hour[self.order], index[self.order]
+        first = np.r_[True, hour[1:] != hour[:-1]] if len(trades) > 0 else np.zeros(0, dtype=bool)
+        self.hours, self._hour_index = hour[first], index[first]
+        self.hour_offsets = np.r_[np.flatnonzero(first), len(trades)] # first row of every delivery hour, and the end
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def trades(self):
+        # all trades in store order, copied on first use only
+        if self._sorted is None:
+            self._sorted = self._trades.iloc[self.order].reset_index(drop=True)
+        return self._sorted
+
+    def take(self, rows, columns):
+        # a frame of the columns of the trades at rows (in store order), without copying the other trades or columns
+        positions = self.order[rows]
+        return pd.DataFrame({name: self._trades[name].array.take(positions) for name in columns})
+
+    def column(self, name, rows):
+        # the values of a column at rows (in store order)
+        return self._trades[name].to_numpy()[self.order[rows]]
+
+    def lead_times(self, rows=slice(None)):
+        # time between trade and delivery hour (ns)
+        return -self._relative[rows]
+
+    def first_rows(self, lead_time):
+        # per delivery hour the first row with a lead time <= lead_time (ns), None for the first row of the hour
+        if lead_time is None:
+            return self.hour_offsets[:-1]
+
+        return np.searchsorted(self._keys, self._hour_index * self._span + np.clip(-lead_time - self._min, 0, self._span - 1), side="left")
+
+    def end_rows(self, lead_time):
+        # per delivery hour the row after the last one with a lead time >= lead_time (ns)
+        return self.first_rows(lead_time - 1)
+
+    @staticmethod
+    def rows(begin, end):
+        # the rows of the slices [begin, end) of all hours
+        lengths = np.maximum(end - begin, 0)
+        return np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(begin, lengths)
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+# Statistics of XBID trades per border and delivery period. Every statistic is derived from partials: aggregates over
+# a group of trades ("sum", "min", "max" or "last" by trade time) that can be merged with the partials of other trades
+# of the same group. So all statistics take one group-by, nested windows merge the partials of the buckets they contain
+# and the live trades merge the partials of new trades into the ones they keep.
+# The trades have float64 PRICE and VOLUME, TRADETIMEUTC, LEAD_HOURS (between the trade and the hour preceding delivery)
+# and WEIGHT: the number of times a trade counts, 0 for a live trade that replaces one counted before.
+
+
+class XbidStat:
+    incremental = True
+
+    def __init__(self, name, partials, value):
+        self.name = name
+        self.partials = partials # partial -> (function of the trades, "sum" | "min" | "max" | "last")
+        self.value = value # function of the merged partials
+
+
+class QuantileStat(XbidStat):
+    # volume weighted price quantile, calculated from the trades of a window as it can not be merged
+    incremental = False
+
+    def __init__(self, name, quantile):
+        super().__init__(name, {}, None)
+        self.quantile = quantile
+
+    def window_value(self, trades, group_cols):
+        trades = trades[trades["WEIGHT"] > 0].sort_values(by="PRICE", kind="stable")
+        volume = trades["WEIGHT"] * trades["VOLUME"]
+
+        grouped = volume.groupby([trades[col] for col in group_cols], observed=True)
+        reached = (grouped.cumsum() >= self.quantile * grouped.transform("sum") - 1e-9).to_numpy()
+
+        return trades["PRICE"][reached].groupby([trades[col][reached] for col in group_cols], observed=True).first()
+
+
+XBID_STATS = {}
+
+
+def register_xbid_stat(stat):
+    XBID_STATS[stat.name] = stat
+    return stat
+
+
+def _weighted(column):
+    return lambda trades: trades["WEIGHT"] * trades[column]
+
+
+_VOLUME = {"VOLUME": (_weighted("VOLUME"), "sum")}
+_VOLPRICE = {"VOLPRICE": (lambda trades: trades["WEIGHT"] * trades["VOLUME"] * trades["PRICE"], "sum"), **_VOLUME}
+
+
+def _std(partials):
+    mean = partials["VOLPRICE"] / partials["VOLUME"]
+    return np.sqrt((partials["VOLPRICE2"] / partials["VOLUME"] - mean ** 2).clip(lower=0))
+
+
+register_xbid_stat(XbidStat("VOLUME", _VOLUME, lambda partials: partials["VOLUME"]))
+register_xbid_stat(XbidStat("AVG_PRICE", _VOLPRICE, lambda partials: partials["VOLPRICE"] / partials["VOLUME"]))
+register_xbid_stat(XbidStat("LAST_PRICE", {"LAST_PRICE": (lambda trades: trades["PRICE"], "last")}, lambda partials: partials["LAST_PRICE"]))
+register_xbid_stat(XbidStat("MIN_PRICE", {"MIN_PRICE": (lambda trades: trades["PRICE"], "min")}, lambda partials: partials["MIN_PRICE"]))
+register_xbid_stat(XbidStat("MAX_PRICE", {"MAX_PRICE": (lambda trades: trades["PRICE"], "max")}, lambda partials: partials["MAX_PRICE"]))
+register_xbid_stat(XbidStat("STD_PRICE", {"VOLPRICE2": (lambda trades: trades["WEIGHT"] * trades["VOLUME"] * trades["PRICE"] ** 2, "sum"), **_VOLPRICE}, _std))
+register_xbid_stat(XbidStat("TRADE_COUNT", {}, lambda partials: partials["TRADE_COUNT"].round().astype("int64")))
+# volume weighted price with trades closer to delivery weighing more: 1 / (1 + lead time in hours)
+register_xbid_stat(XbidStat("TW_AVG_PRICE", {
+    "TWVOLPRICE": (lambda trades: trades["WEIGHT"] * trades["VOLUME"] * trades["PRICE"] / (1 + trades["LEAD_HOURS"]), "sum"),
+    "TWVOLUME": (lambda trades: trades["WEIGHT"] * trades["VOLUME"] / (1 + trades["LEAD_HOURS"]), "sum"),
+}, lambda partials: partials["TWVOLPRICE"] / partials["TWVOLUME"]))
+register_xbid_stat(QuantileStat("P10_PRICE", 0.1))
+register_xbid_stat(QuantileStat("P50_PRICE", 0.5))
+register_xbid_stat(QuantileStat("P90_PRICE", 0.9))
+
+DEFAULT_XBID_STATS = ["VOLUME", "LAST_PRICE", "AVG_PRICE"]
+
+# kept for every group: whether it has trades and the time of its last trade (ns), to merge "last" partials
+_GROUP_PARTIALS = {
+    "TRADE_COUNT": (lambda trades: trades["WEIGHT"], "sum"),
+    "LAST_TIME": (lambda trades: trades["TRADETIMEUTC"].to_numpy().view("int64"), "max"),
+}
+
+
+def _partials(stats):
+    partials = dict(_GROUP_PARTIALS)
+    for stat in stats:
+        partials.update(XBID_STATS[stat].partials)
+    return partials
+
+
+def is_incremental(stats):
+    return all(XBID_STATS[stat].incremental for stat in stats)
+
+
+def calculate_partials(trades, stats, group_cols, presorted=False):
+    # presorted: the trades of every group are in trade time order already
+    partials = _partials(stats)
+    if not presorted:
+        trades = trades.sort_values(by="TRADETIMEUTC", kind="stable")
+
+    inputs = pd.DataFrame({name: np.asarray(function(trades)) for name, (function, _) in partials.items()}, index=trades.index)
+    return inputs.groupby([trades[col] for col in group_cols], observed=True).agg(**{name: (name, how) for name, (_, how) in partials.items()})
+
+
+def merge_partials(frames, stats):
+    # partials of the same groups from different trades, on equal trade times the later frames have the last trade
+    partials = pd.concat(frames).sort_values(by="LAST_TIME", kind="stable")
+    return partials.groupby(level=list(partials.index.names), observed=True).agg({name: how for name, (_, how) in _partials(stats).items()})
+
+
+def cumulate_partials(partials, stats, buckets):
+    # Partials indexed by group and BUCKET, for nested windows: bucket -> partials of the buckets up to it per group.
+    # The tighter buckets have the later trades, so the last trade of a window is in its tightest bucket with trades.
+    # The partials are as grouped by calculate_partials or merge_partials (the buckets of a group are adjacent) and are
+    # cumulated as group x bucket arrays.
+    groups = partials.index.droplevel("BUCKET")
+    codes = np.array(groups.codes) if isinstance(groups, pd.MultiIndex) else groups.factorize()[0][None, :]
+    first = np.r_[True, (codes[:, 1:] != codes[:, :-1]).any(axis=0)] if len(partials) > 0 else np.zeros(0, dtype=bool)
+    group = np.cumsum(first) - 1
+    bucket = buckets.get_indexer(partials.index.get_level_values("BUCKET"))
+
+    in_buckets = bucket >= 0
+    shape = (int(first.sum()), len(buckets))
+
+    cumulated = {}
+    for name, (_, how) in _partials(stats).items():
+        values = np.full(shape, np.nan)
+        values[group[in_buckets], bucket[in_buckets]] = partials[name].to_numpy(dtype="float64")[in_buckets]
+        if how == "sum":
+            values = np.nan_to_num(values, nan=0).cumsum(axis=1)
+        elif how == "min":
+            values = np.fmin.accumulate(values, axis=1)
+        elif how == "max":
+            values = np.fmax.accumulate(values, axis=1)
+        else:
+            # the value of the tightest bucket with one
+            tightest = np.minimum.accumulate(np.where(np.isnan(values), len(buckets), np.arange(len(buckets))), axis=1)
+            values = np.take_along_axis(np.c_[values, np.full(len(values), np.nan)], tightest, axis=1)
+        cumulated[name] = values
+
+    index = groups[first]
+    return {value: pd.DataFrame({name: values[:, i] for name, values in cumulated.items()}, index=index) for i, value in enumerate(buckets)}
+
+
+def calculate_stats(partials, stats, trades=None, group_cols=None):
+    # the stats of the groups with trades, non incremental stats need the trades of those groups
+    partials = partials[partials["TRADE_COUNT"] > 0]
+
+    values = pd.DataFrame(index=partials.index)
+    for stat in stats:
+        if XBID_STATS[stat].incremental:
+            values[stat] = XBID_STATS[stat].value(partials)
+        else:
+            values[stat] = XBID_STATS[stat].window_value(trades, group_cols)
+    return values
@@ -1,4 +1,5 @@
 from datetime import datetime
+from functools import cached_property
 
 import numpy as np
 import pandas as pd
@@ -12,6 +13,15 @@ from src.model.cmol.cmol_types import XML_FLOW_DIRECTION_MAP, XML_BUSINESS_TYPE,
 
 NAMESPACE = {"ns": "urn:iec62325.351:tc57wg16:451-7:moldocument:7:3"}
 
+# one row per bid, price is the volume weighted price over the bid's points
+BID_BOOK_DTYPE = np.dtype([
+    ("area", "U16"),
+    ("direction", "U4"),
+    ("status", "U11"),
+    ("price", "f8"),
+    ("quantity", "f8"),
+])
+
 class CMOLPoint:
     def __init__(self, position, quantity, price):
         self.position = position # according to documentation this thing is always 1
@@ -66,20 +76,25 @@ class CMOLBid:
             points=parsed["points"]
         )
 
-    @property
+    @cached_property
     def quantity(self):
         return sum([point.quantity for point in self.points])
 
-    @property
+    @cached_property
     def price(self):
         return sum([point.price * point.quantity for point in self.points]) / self.quantity if self.quantity > 0 else None
 
 class CMOL:
-    def __init__(self, creation_utc, start_utc, end_utc, bids: [CMOLBid]):
+    def __init__(self, creation_utc, start_utc, end_utc, bids: [CMOLBid], book=None):
         self.creation_utc = creation_utc
         self.start_utc = start_utc
         self.end_utc = end_utc
         self.bids = bids
+        self.book = book if book is not None else CMOL._to_book(bids)
+
+    @staticmethod
+    def _to_book(bids):
+        return np.array([(bid.connecting_domain_id.area_code, bid.direction, bid.status, bid.price, bid.quantity) for bid in bids], dtype=BID_BOOK_DTYPE)
 
     @staticmethod
     def _parse_utc(utc, has_seconds=False):
@@ -106,83 +121,104 @@ class CMOL:
 
         return CMOL(creation_utc=CMOL._parse_utc(createdDateTime, has_seconds=True), start_utc=CMOL._parse_utc(start_time), end_utc=CMOL._parse_utc(end_time), bids=bids)
 
-    def groupby_region(self):
-        cmol_by_area_and_direction = {}
-        for bid in self.bids:
-            key = (bid.connecting_domain_id, bid.direction)
-            if key not in cmol_by_area_and_direction:
-                cmol_by_area_and_direction[key] = []
-
-            cmol_by_area_and_direction[key].append(bid)
-
-        return cmol_by_area_and_direction
+    @staticmethod
+    def from_events(events):
+        # Streaming counterpart of from_xml: consumes the "start" and "end" events of an incremental parse (ET.iterparse /
+        # ET.XMLPullParser) and removes every TimeSeries from its parent as soon as its bid is extracted, so the document
+        # tree is never held in memory. A TimeSeries that just ended is the last child of its parent.
+        createdDateTime = None
+        start_time = None
+        end_time = None
+
+        time_series_tag = f"{{{NAMESPACE['ns']}}}TimeSeries"
+        created_tag = f"{{{NAMESPACE['ns']}}}createdDateTime"
+        interval_tag = f"{{{NAMESPACE['ns']}}}period.timeInterval"
 
-    def transform_bids(self, bids, quantiles, flow_direction):
-        result = {}
+        bids = []
+        parents = [] # the open elements
+        for event, element in events:
+            if event == "start":
+                parents.append(element)
+                continue
+            elif parents:
+                parents.pop()
+
+            if element.tag == time_series_tag:
+                bid = CMOLBid.from_xml(element)
+                if bid.price is not None and bid.quantity > 0:
+                    bids.append(bid)
+                element.clear()
+                if parents:
+                    del parents[-1][-1]
+            elif element.tag == created_tag and createdDateTime is None:
+                createdDateTime = element.text
+            elif element.tag == interval_tag:
+                start_time = element.find("ns:start", NAMESPACE).text
+                end_time = element.find("ns:end", NAMESPACE).text
 
-        bids_sorted = sorted(bids, key=lambda x: x.price if flow_direction == "UP" else -x.price)
-        bids_volume = sum([bid.quantity for bid in bids_sorted if bid.status == MarketObjectStatus.AVAILABLE])
+        return CMOL(creation_utc=CMOL._parse_utc(createdDateTime, has_seconds=True), start_utc=CMOL._parse_utc(start_time), end_utc=CMOL._parse_utc(end_time), bids=bids)
 
-        for quantile in quantiles:
-            level = quantile * bids_volume
+    @staticmethod
+    def _sort_available(bids, flow_direction):
+        available = bids[bids["status"] == MarketObjectStatus.AVAILABLE]
+        return available[np.argsort(available["price"] if flow_direction == FlowDirection.UP else -available["price"], kind="stable")]
 
-            ## Marginal price
-            max_price = None
-            quantity = 0
-            for bid in bids_sorted:
-                if quantity >= max(level, 1): # 1 MW is the minimum quantity
-                    break
+    @staticmethod
+    def _marginal_prices(prices, cumulative, quantiles):
+        # prices sorted in merit order, cumulative the running sum of their quantities
+        if len(prices) == 0 or cumulative[-1] <= 0:
+            return {str(int(1000*quantile)): None for quantile in quantiles}
 
-                if bid.status == MarketObjectStatus.AVAILABLE:
-                    max_price = bid.price
-                    quantity += bid.quantity
+        levels = np.maximum(np.asarray(quantiles, dtype=float) * cumulative[-1], 1) # 1 MW is the minimum quantity
 
-            result[str(int(1000*quantile))] = max_price if quantity > 0 else None
+        ## Marginal price: bids are taken until the quantity accumulated before them reaches the level
+        taken = 1 + np.searchsorted(cumulative[:-1], levels, side="left")
+        marginal_prices = prices[taken - 1]
 
-        return result
+        return {str(int(1000*quantile)): float(price) for quantile, price in zip(quantiles, marginal_prices)}
 
-    def to_lmol_df(self, quantiles):
-        cmol_by_area_and_direction = self.groupby_region()
+    def to_mol_dfs(self, quantiles):
+        # LMOL (per region) and CMOL (all regions) frames from a single merit order sort per direction,
+        # a region's bids keep their merit order when selected from the sorted direction
+        sorted_bids = {direction: self._sort_available(self.book[self.book["direction"] == direction], direction) for direction in (FlowDirection.UP, FlowDirection.DOWN)}
 
-        ups = []
-        downs = []
-        for (region, direction), bids in cmol_by_area_and_direction.items():
-            available_bids = [bid for bid in bids if bid.status == MarketObjectStatus.AVAILABLE]
+        # every region present in the document gets a row, even if none of its bids are available
+        keys, first_index = np.unique(self.book[["area", "direction"]], return_index=True)
 
-            transformed = self.transform_bids(available_bids, quantiles=quantiles, flow_direction=direction)
-            transformed["REGION"] = region.area_code
-            transformed["VOLUME"] = sum([bid.quantity for bid in available_bids])
+        lmols = {FlowDirection.UP: [], FlowDirection.DOWN: []}
+        for key in keys[np.argsort(first_index)]:
+            region, direction = str(key["area"]), str(key["direction"])
+            bids = sorted_bids[direction][sorted_bids[direction]["area"] == region]
+            cumulative = np.cumsum(bids["quantity"])
 
-            if direction == FlowDirection.UP:
-                ups.append(transformed)
-            else:
-                downs.append(transformed)
+            transformed = self._marginal_prices(bids["price"], cumulative, quantiles)
+            transformed["REGION"] = region
+            transformed["VOLUME"] = cumulative[-1] if len(cumulative) > 0 else 0
+            lmols[direction].append(transformed)
 
-        ups = pd.DataFrame(ups)
-        downs = pd.DataFrame(downs)
+        ups = pd.DataFrame(lmols[FlowDirection.UP])
+        downs = pd.DataFrame(lmols[FlowDirection.DOWN])
 
         ups = ups.rename(columns={level: f"UP_{level}" for level in ups.columns if level != "REGION"})
         downs = downs.rename(columns={level: f"DOWN_{level}" for level in downs.columns if level != "REGION"})
 
-        df = ups.merge(downs, on="REGION", how="outer")
-        df["UTCTIME"] = self.start_utc
-        return df
-
-    def to_cmol_df(self, quantiles):
-        up_bids = [bid for bid in self.bids if bid.direction == FlowDirection.UP and bid.status == MarketObjectStatus.AVAILABLE]
-        down_bids = [bid for bid in self.bids if bid.direction == FlowDirection.DOWN and bid.status == MarketObjectStatus.AVAILABLE]
+        lmol_df = ups.merge(downs, on="REGION", how="outer")
+        lmol_df["UTCTIME"] = self.start_utc
 
-        up_volume = sum([bid.quantity for bid in up_bids])
-        down_volume = sum([bid.quantity for bid in down_bids])
+        concatenated = {}
+        for direction in (FlowDirection.UP, FlowDirection.DOWN):
+            bids = sorted_bids[direction]
+            cumulative = np.cumsum(bids["quantity"])
 
-        up_transformed = self.transform_bids(up_bids, quantiles=quantiles, flow_direction=FlowDirection.UP)
-        down_transformed = self.transform_bids(down_bids, quantiles=quantiles, flow_direction=FlowDirection.DOWN)
+            transformed = self._marginal_prices(bids["price"], cumulative, quantiles)
+            transformed["VOLUME"] = cumulative[-1] if len(cumulative) > 0 else 0
+            concatenated.update({f"{direction}_{k}": v for k, v in transformed.items()})
 
-        up_transformed["VOLUME"] = up_volume
-        down_transformed["VOLUME"] = down_volume
+        concatenated["UTCTIME"] = self.start_utc
+        return lmol_df, pd.DataFrame([concatenated])
 
-        concatenated = {f"UP_{k}": v for k,v in up_transformed.items()}
-        concatenated.update({f"DOWN_{k}": v for k,v in down_transformed.items()})
+    def to_lmol_df(self, quantiles):
+        return self.to_mol_dfs(quantiles)[0]
 
-        concatenated["UTCTIME"] = self.start_utc
-        return pd.DataFrame([concatenated])
\ No newline at end of file
+    def to_cmol_df(self, quantiles):
+        return self.to_mol_dfs(quantiles)[1]
@@ -5,6 +5,7 @@ import pytz
 
 from src.math.atc.atc_optimizer import ATCGraphOptimizer
 from src.utils.database.msdb_elindus import HexatradersDatabase_RO, HexatradersDatabase
+from src.utils.database.sinks import TableSink
 from src.utils.tasks.task_orchestrator import Task
 
 
@@ -17,14 +18,14 @@ class H2HToATCTask(Task):
         self.msdb = HexatradersDatabase.get_instance()
 
     def get_data(self, from_utc, to_utc):
-        df = self.msdb_ro.query(f"""
+        df = self.msdb_ro.query_params("""
                     WITH max_creation AS (
                         SELECT utctime, from_area, to_area, MAX(creationdate) AS max_creationdate
                         FROM nordpool.HUBTOHUBCAPACITIES
                         WHERE 
                             creationdate < DATEADD(minute, -65, utctime)
-                            AND UTCTIME >= '{from_utc.isoformat()}'
-                            AND UTCTIME < '{to_utc.isoformat()}'
+                            AND UTCTIME >= :from_utc
+                            AND UTCTIME < :to_utc
                         group by from_area, to_area, utctime
                     )
 
@@ -33,9 +34,9 @@ class H2HToATCTask(Task):
                     JOIN max_creation mc
                         ON h.utctime = mc.utctime and h.to_area = mc.to_area and h.from_area=mc.from_area and h.creationdate = mc.max_creationdate
                     WHERE 
-                        h.UTCTIME >= '{from_utc.isoformat()}'
-                        AND h.UTCTIME < '{to_utc.isoformat()}'
-                                        """)
+                        h.UTCTIME >= :from_utc
+                        AND h.UTCTIME < :to_utc
+                                        """, {"from_utc": from_utc, "to_utc": to_utc})
 
         df.loc[df["FROM_AREA"] == "AMP", "FROM_AREA"] = "DE"
         df.loc[df["TO_AREA"] == "AMP", "TO_AREA"] = "DE"
@@ -75,7 +76,7 @@ class H2HToATCTask(Task):
         data = self.get_data(fromutc, toutc)
         df = self.convert(data)
 
-        self.msdb.bulk_upsert(df, "traders.INTRADAY_ATC_CAPACITY_DERIVED", key_cols=["UTCTIME", "FROM_AREA", "TO_AREA"], data_cols=["IN_CAPACITY", "OUT_CAPACITY", "CREATIONDATE"])
+        self.writer.write(df, [TableSink(self.msdb, "traders.INTRADAY_ATC_CAPACITY_DERIVED", key_cols=["UTCTIME", "FROM_AREA", "TO_AREA"], data_cols=["IN_CAPACITY", "OUT_CAPACITY", "CREATIONDATE"], moddate_col=None)])
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ from dateutil.relativedelta import relativedelta
 from src.jao.jao_api import JaoAPI
 from src.utils.constants import LOCALTZ
 from src.utils.database.nxtdatabase import NXTDatabase
+from src.utils.database.sinks import TableSink
 from src.utils.tasks.task_orchestrator import Task
 
 
@@ -32,7 +33,7 @@ class DABorderFlowsJAO(Task):
         df = self.jao_api.get_core_scheduled_exchanges(fromutc, toutc)
 
         if len(df) > 0:
-            self.nxt_db.bulk_upsert(df, "DA_CORE_BORDER_FLOWS_JAO", self.cols, "CREATIONDATE")
+            self.writer.write(df, [TableSink(self.nxt_db, "DA_CORE_BORDER_FLOWS_JAO", key_cols=["UTCTIME"], data_cols=self.cols[1:])])
         else:
             print("NO DATA FOUND")
 
@@ -55,7 +56,7 @@ class DANetpositionsJAO(Task):
         df = self.jao_api.get_core_netpositions(fromutc, toutc)
 
         if len(df) > 0:
-            self.nxt_db.bulk_upsert(df, "DA_CORE_NETPOSITIONS_JAO", self.cols, "CREATIONDATE")
+            self.writer.write(df, [TableSink(self.nxt_db, "DA_CORE_NETPOSITIONS_JAO", key_cols=["UTCTIME"], data_cols=self.cols[1:])])
         else:
             print("NO DATA FOUND")
 
@@ -82,7 +83,7 @@ class NTCJAO(Task):
         df = self.jao_api.get_ntc(fromutc, toutc)
 
         if len(df) > 0:
-            self.nxt_db.bulk_upsert(df, "DA_CORE_NTC_JAO", self.cols, "CREATIONDATE")
+            self.writer.write(df, [TableSink(self.nxt_db, "DA_CORE_NTC_JAO", key_cols=["UTCTIME"], data_cols=self.cols[1:])])
         else:
             print("NO DATA FOUND")
 
@@ -120,8 +121,8 @@ class ATCJAO(Task):
             df_deltas = df[[("DELTA_" + c) if not c == "UTCTIME" else c for c in self.cols_updates]].rename(
                 columns=lambda x: x.replace('DELTA_', ''))
 
-            self.nxt_db.bulk_upsert(df, "DA_CORE_ATC_JAO", self.cols, "CREATIONDATE")
-            self.nxt_db.bulk_upsert(df_deltas.fillna(0), "ID_CORE_NTC_UPDATES_JAO", self.cols_updates, "CREATIONDATE")
+            self.writer.write(df, [TableSink(self.nxt_db, "DA_CORE_ATC_JAO", key_cols=["UTCTIME"], data_cols=self.cols[1:])])
+            self.writer.write(df_deltas.fillna(0), [TableSink(self.nxt_db, "ID_CORE_NTC_UPDATES_JAO", key_cols=["UTCTIME"], data_cols=self.cols_updates[1:])])
         else:
             print("NO DATA FOUND")
 
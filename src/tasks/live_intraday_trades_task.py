@@ -1,55 +1,84 @@
+import numpy as np
+
 from src.intraday.live_intraday_trades import LiveIntradayTrades
+from src.intraday.xbid_stats import DEFAULT_XBID_STATS
 from src.utils.tasks.task_orchestrator import Task
 import time
 
+# (key columns, uploaded value columns) of the frames that are diffed between runs
+NETBORDER_COLS = (["UTCTIME", "BUYERAREA", "SELLERAREA"], ["VOLUME", "PRICE"])
+NETBORDER_PRODUCT_COLS = (["UTCTIME", "BUYERAREA", "SELLERAREA", "PRODUCTTYPE"], ["VOLUME", "PRICE"])
+LT_STATS_COLS = (["UTCTIME", "PRODUCTTYPE", "TAG", "BUYERAREA", "SELLERAREA"], DEFAULT_XBID_STATS)
+CHANGE_TOLERANCE = 1e-6 # absolute, far below the price and volume ticks
+
+
 class LiveIntradayTradesTask(Task):
-    def __init__(self, region):
+    def __init__(self, region, write_behind=False):
         self.region = region
-        super().__init__(frequency=60, task=self.run, task_name=self.__str__())
+        super().__init__(frequency=60, task=self.run, task_name=self.__str__(), write_behind=write_behind)
 
-        self.lit = LiveIntradayTrades(region)
+        self.lit = LiveIntradayTrades(region, writer=self.writer)
         self._prev_netborder = None
         self._prev_netborder_h = None
         self._prev_netborder_qh = None
         self._prev_netborder_hh = None
         self._prev_lt_stats = None
 
-    def _filter_new_trades(self, trades_df, prev_trades_df):
-        if prev_trades_df is not None:
-            set_old = set(prev_trades_df.itertuples(index=False))
-            mask = [x not in set_old for x in trades_df.itertuples(index=False)]
-            filtered_trades = trades_df[mask].copy()
-        else:
-            filtered_trades = trades_df
-        return filtered_trades
+    def _filter_new_trades(self, trades_df, prev_trades_df, cols):
+        # rows that are new since prev_trades_df or of which a value changed by more than CHANGE_TOLERANCE
+        key_cols, value_cols = cols
+        if prev_trades_df is None or len(prev_trades_df) == 0 or len(trades_df) == 0:
+            return trades_df
+
+        prev_trades_df = prev_trades_df.drop_duplicates(subset=key_cols, keep="last")
+        merged = trades_df.merge(prev_trades_df, on=key_cols, how="left", suffixes=("", "_PREV"), indicator=True)
 
+        changed = (merged["_merge"] == "left_only").to_numpy()
+        for col in value_cols:
+            changed |= ~np.isclose(merged[col], merged[col + "_PREV"], rtol=0, atol=CHANGE_TOLERANCE, equal_nan=True)
+
+        return trades_df[changed]
 
     def run(self):
-        trades = self.lit.get_live_trades()
-        netborder, netborder_h, netborder_hh, netborder_qh = self.lit.calculate_netborder(trades)
+        netborder, netborder_h, netborder_hh, netborder_qh = self.lit.get_live_netborder()
 
-        # simplify netborder inserts by selecting the new trades only
-        netborder_filtered = self._filter_new_trades(netborder, self._prev_netborder)
-        netborder_h_filtered = self._filter_new_trades(netborder_h, self._prev_netborder_h)
-        netborder_hh_filtered = self._filter_new_trades(netborder_hh, self._prev_netborder_hh)
-        netborder_qh_filtered = self._filter_new_trades(netborder_qh, self._prev_netborder_qh)
+        # simplify netborder inserts by selecting the new or changed rows only
+        netborder_filtered = self._filter_new_trades(netborder, self._prev_netborder, NETBORDER_COLS)
+        netborder_h_filtered = self._filter_new_trades(netborder_h, self._prev_netborder_h, NETBORDER_PRODUCT_COLS)
+        netborder_hh_filtered = self._filter_new_trades(netborder_hh, self._prev_netborder_hh, NETBORDER_PRODUCT_COLS)
+        netborder_qh_filtered = self._filter_new_trades(netborder_qh, self._prev_netborder_qh, NETBORDER_PRODUCT_COLS)
 
-        print(f"UPLOADING {len(netborder_filtered),len(netborder_h_filtered),len(netborder_hh_filtered),len(netborder_qh_filtered)} RECORDS")
-        if not netborder_filtered.empty:
-            self.lit.upload_netborder(netborder_filtered, netborder_h=netborder_h_filtered, netborder_hh=netborder_hh_filtered, netborder_q=netborder_qh_filtered)
+        changed = {"H": len(netborder_h_filtered), "HH": len(netborder_hh_filtered), "QH": len(netborder_qh_filtered)}
+        print(f"UPLOADING {len(netborder_filtered)} OF {len(netborder)} NETBORDER RECORDS, CHANGED PER PRODUCT {changed}")
+        # the previous frames are set before uploading, a failed or dropped write resets them so the next run sends everything
         self._prev_netborder = netborder
         self._prev_netborder_h = netborder_h
         self._prev_netborder_hh = netborder_hh
         self._prev_netborder_qh = netborder_qh
+        if not netborder_filtered.empty:
+            self.lit.upload_netborder(netborder_filtered, netborder_h=netborder_h_filtered, netborder_hh=netborder_hh_filtered, netborder_q=netborder_qh_filtered,
+                                      on_failed=self._reset_netborder)
 
         if self.region == "Belgium": # also upload LT stats for Belgium
-            lt_stats = self.lit.get_xbid_stats_lt(trades)
-            lt_stats_filtered = self._filter_new_trades(lt_stats, self._prev_lt_stats)
+            lt_stats = self.lit.get_live_xbid_stats_lt(update=False)
+            lt_stats_filtered = self._filter_new_trades(lt_stats, self._prev_lt_stats, LT_STATS_COLS)
 
-            print(f"UPLOADING {len(lt_stats_filtered)} XBID STATS RECORDS")
+            changed = lt_stats_filtered["PRODUCTTYPE"].value_counts().to_dict()
+            print(f"UPLOADING {len(lt_stats_filtered)} OF {len(lt_stats)} XBID STATS RECORDS, CHANGED PER PRODUCT {changed}")
+            self._prev_lt_stats = lt_stats
             if not lt_stats_filtered.empty:
-                self.lit.upload_xbid_stats(lt_stats_filtered)
+                self.lit.upload_xbid_stats(lt_stats_filtered, on_failed=self._reset_lt_stats)
 
+    def _reset_netborder(self):
+        print(f"{self}: netborder upload failed, uploading all rows next run")
+        self._prev_netborder = None
+        self._prev_netborder_h = None
+        self._prev_netborder_hh = None
+        self._prev_netborder_qh = None
+
+    def _reset_lt_stats(self):
+        print(f"{self}: XBID stats upload failed, uploading all rows next run")
+        self._prev_lt_stats = None
 
     def __str__(self):
         return f'LiveIntradayTrades[{self.region}]'
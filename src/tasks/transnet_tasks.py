@@ -1,16 +1,21 @@
+import os
 from datetime import date, timedelta, datetime
+from functools import partial
 
 import pandas as pd
 
 from src.transnet.transnet_api import TransnetAPI
+from src.utils.constants import CACHE_PATH
 from src.utils.tasks.task_orchestrator import Task
 
 
 class UploadPICASSOMOLTask(Task):
     def __init__(self, **kwargs):
         super().__init__(task=self.upload_data, task_name="UPLOAD PICASSO MOL", **kwargs)
-        self.transnet_api = TransnetAPI()
+        self.transnet_api = TransnetAPI(cache_dir=os.path.join(CACHE_PATH, "picasso_cmol"), writer=self.writer)
         self.c = 0
+        self._uploading = set() # days whose upload is still queued, their checkpoint is committed once it is written
+                                # and the day is released without a commit if the writer dropped it
 
     def upload_data(self):
         fromdt = date.today() - timedelta(days=1 if self.c % 10 == 0 else 0)
@@ -18,23 +23,39 @@ class UploadPICASSOMOLTask(Task):
         dt = fromdt
 
         while dt < todt:
+            if dt in self._uploading:
+                print("Previous upload still pending for", dt)
+                dt += timedelta(days=1)
+                continue
+
             print("Uploading", dt)
-            cmols = self.transnet_api.get_picasso_cmol(dt)
+            cmols = self.transnet_api.get_picasso_cmol(dt, incremental=True)
 
-            if cmols is not None:
-                self.transnet_api.upload_lmols(cmols)
-                self.transnet_api.upload_cmols(cmols)
-            else:
+            if cmols is None:
                 print("No data found for", dt)
+            elif len(cmols) > 0:
+                self._uploading.add(dt)
+                try:
+                    self.transnet_api.upload_mols(cmols, on_written=partial(self._commit, dt), on_failed=partial(self._uploading.discard, dt))
+                except Exception:
+                    # not written (a synchronous writer raises before on_written), left uncommitted so the next run retries it
+                    self._uploading.discard(dt)
+                    raise
+            else:
+                self.transnet_api.commit_picasso_cmol(dt)
 
             dt += timedelta(days=1)
 
         self.c += 1
 
+    def _commit(self, dt):
+        self.transnet_api.commit_picasso_cmol(dt)
+        self._uploading.discard(dt)
+
 class UploadPICASSOExchangedVolumesTask(Task):
     def __init__(self, **kwargs):
         super().__init__(task=self.upload_data, task_name="UPLOAD PICASSO EXCHANGED VOLUMES", **kwargs)
-        self.transnet_api = TransnetAPI()
+        self.transnet_api = TransnetAPI(writer=self.writer)
 
     def upload_data(self):
         today = date.today()
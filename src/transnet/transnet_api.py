@@ -1,6 +1,9 @@
+import hashlib
+import json
 import re
 import tempfile
 import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import date, datetime, timedelta
 from io import StringIO, BytesIO
 import os
@@ -14,10 +17,27 @@ from src.intraday.delivery_areas import TSO_AREA_MAPPING
 from src.model.cmol.cmol import CMOL
 from src.utils.database.msdb_elindus import HexatradersDatabase
 from src.utils.database.nxtdatabase import NXTDatabase
+from src.utils.database.sinks import TableSink, MultiSinkWriter
 
 MOL_QUANTILES = (0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1)
+PICASSO_CMOL_URL = "https://webservices.transnetbw.de/files/bis/picasso/cmol/AFRR_PUBLICATION_PICASSO-CMOL_{}.zip"
+PICASSO_CMOL_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36"
+}
+PICASSO_CMOL_FINAL_AFTER = timedelta(hours=2) # a day archive fetched this long after the end of the day is not revalidated anymore
+PICASSO_CMOL_CACHE_DAYS = 7 # cached day archives, with their metadata and checkpoint, older than this are deleted after a download
 
 class TransnetAPI:
+    def __init__(self, cache_dir=None, cmol_url=PICASSO_CMOL_URL, writer=None, cache_days=PICASSO_CMOL_CACHE_DAYS):
+        self.cache_dir = cache_dir
+        self.cmol_url = cmol_url
+        self.cache_days = cache_days # None keeps every cached day
+        self.writer = writer if writer is not None else MultiSinkWriter.get_instance()
+
+        self._pending_checkpoints = {}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
 
     def get_picasso_cbmp(self, date):
         url = "https://api.transnetbw.de/picasso-cbmp/csv?date={}".format(date.strftime("%Y-%m-%d"))
@@ -41,60 +61,233 @@ class TransnetAPI:
 
         return df
 
-    def get_picasso_cmol(self, date):
-        url = "https://webservices.transnetbw.de/files/bis/picasso/cmol/AFRR_PUBLICATION_PICASSO-CMOL_{}.zip".format(date.strftime("%Y%m%d"))
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36"
+    def get_picasso_cmol(self, date, streaming=False, processes=None, incremental=False):
+        # returns None if the archive could not be downloaded and an empty list if the cached archive was already processed,
+        # incremental only returns the quarter-hours whose winning revision changed since the last commit_picasso_cmol
+        if incremental and self.cache_dir is None:
+            raise Exception("Incremental CMOL ingestion requires a cache_dir to keep its checkpoint in")
+
+        if self.cache_dir is None:
+            r = requests.get(self.cmol_url.format(date.strftime("%Y%m%d")), headers=PICASSO_CMOL_HEADERS, stream=True, timeout=60)
+
+            if r.status_code != 200:
+                print(f"Failed to download ZIP. HTTP Status Code: {r.status_code}")
+                return None
+
+            archive = BytesIO(r.content) # Open the ZIP file in memory
+        else:
+            meta = self._fetch_cached_picasso_cmol(date)
+
+            if meta is None:
+                return None
+            elif meta["processed"]:
+                print(f"Archive for {date} unchanged since it was last processed")
+                return []
+
+            archive = self._get_cache_path(date)
+
+        with zipfile.ZipFile(archive) as zip_file:
+            index = self._index_zip(zip_file)
+
+            if incremental:
+                checkpoint = self._load_checkpoint(date)
+                index = {dt: revisions for dt, revisions in index.items() if checkpoint.get(dt.isoformat()) != self._to_checkpoint_entry(revisions[0])}
+
+            if processes is None:
+                parsed = self._parse_cmols(zip_file, index, streaming)
+            else:
+                with ProcessPoolExecutor(max_workers=processes) as executor:
+                    parsed = self._parse_cmols(zip_file, index, streaming, executor=executor)
+
+        cmols = [cmol for _, cmol in parsed.values()]
+        if incremental:
+            # the revision that was parsed, a fallback if the winner failed so that the winner is retried next time
+            print(f"{len(cmols)} quarter-hours changed for {date}")
+            self._pending_checkpoints[date] = {dt.isoformat(): self._to_checkpoint_entry(revision) for dt, (revision, _) in parsed.items()}
+
+        return cmols
+
+    def commit_picasso_cmol(self, date):
+        # marks the cached archive as processed, so it is neither downloaded nor parsed again until it changes,
+        # and checkpoints the revisions returned by an incremental get_picasso_cmol
+        if self.cache_dir is None:
+            return
+
+        if date in self._pending_checkpoints:
+            checkpoint = self._load_checkpoint(date)
+            checkpoint.update(self._pending_checkpoints.pop(date))
+            self._write_json(self._get_cache_path(date) + ".checkpoint.json", checkpoint)
+
+        meta = self._load_cache_meta(date)
+        if meta is not None:
+            meta["processed"] = True
+            self._save_cache_meta(date, meta)
+
+    def _load_checkpoint(self, date):
+        # start time -> [creation time, file name] of the revision that was last uploaded
+        path = self._get_cache_path(date) + ".checkpoint.json"
+        if not os.path.exists(path):
+            return {}
+
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _to_checkpoint_entry(self, revision):
+        creation_utc, file_name = revision
+        return [creation_utc.isoformat(), file_name]
+
+    def _write_json(self, path, obj):
+        with tempfile.NamedTemporaryFile("w", dir=self.cache_dir, delete=False) as f:
+            json.dump(obj, f)
+        os.replace(f.name, path)
+
+    def _get_cache_path(self, date):
+        return os.path.join(self.cache_dir, os.path.basename(self.cmol_url.format(date.strftime("%Y%m%d"))))
+
+    def _load_cache_meta(self, date):
+        path = self._get_cache_path(date)
+        if not os.path.exists(path) or not os.path.exists(path + ".json"):
+            return None
+
+        with open(path + ".json", "r") as f:
+            return json.load(f)
+
+    def _save_cache_meta(self, date, meta):
+        self._write_json(self._get_cache_path(date) + ".json", meta)
+
+    def _fetch_cached_picasso_cmol(self, date):
+        # revalidates the cached archive (ETag/Last-Modified, else Content-Length) and downloads it only if it changed
+        url = self.cmol_url.format(date.strftime("%Y%m%d"))
+        meta = self._load_cache_meta(date)
+        now = datetime.now()
+
+        if meta is not None:
+            if datetime.fromisoformat(meta["fetched_at"]) >= datetime.combine(date + timedelta(days=1), datetime.min.time()) + PICASSO_CMOL_FINAL_AFTER:
+                return meta # completed past day
+
+            if meta["etag"] is None and meta["last_modified"] is None:
+                r = requests.head(url, headers=PICASSO_CMOL_HEADERS, timeout=60)
+                if r.status_code == 200 and r.headers.get("Content-Length") == str(meta["size"]):
+                    meta["fetched_at"] = now.isoformat()
+                    self._save_cache_meta(date, meta)
+                    return meta
+
+        headers = dict(PICASSO_CMOL_HEADERS)
+        if meta is not None and meta["etag"] is not None:
+            headers["If-None-Match"] = meta["etag"]
+        if meta is not None and meta["last_modified"] is not None:
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        with requests.get(url, headers=headers, stream=True, timeout=60) as r: # releases the connection on every path
+            if r.status_code == 304 and meta is not None:
+                meta["fetched_at"] = now.isoformat()
+                self._save_cache_meta(date, meta)
+                return meta
+            elif r.status_code != 200:
+                print(f"Failed to download ZIP. HTTP Status Code: {r.status_code}")
+                return None
+
+            sha256 = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as f:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    sha256.update(chunk)
+                    f.write(chunk)
+
+        if meta is not None:
+            os.remove(self._get_cache_path(date) + ".json") # never pair stale metadata with the new archive
+        os.replace(f.name, self._get_cache_path(date))
+
+        new_meta = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "size": os.path.getsize(self._get_cache_path(date)),
+            "sha256": sha256.hexdigest(),
+            "fetched_at": now.isoformat(),
+            "processed": meta is not None and meta["processed"] and meta["sha256"] == sha256.hexdigest(),
         }
+        self._save_cache_meta(date, new_meta)
+        self._prune_cache(keep=date)
 
-        r = requests.get(url, headers=headers, stream=True, timeout=60)
+        return new_meta
 
-        if r.status_code == 200:
+    def _prune_cache(self, keep):
+        # deletes the archives, metadata and checkpoints of the days before the last cache_days, except keep
+        if self.cache_days is None:
+            return
 
-            # Open the ZIP file in memory
-            with zipfile.ZipFile(BytesIO(r.content)) as zip_file:
-                # List all files in the ZIP
-                file_list = sorted(zip_file.namelist(), reverse=True) # reverse sort to get the latest files first
+        prefix, suffix = os.path.basename(self.cmol_url).split("{}")
+        oldest = date.today() - timedelta(days=self.cache_days)
 
-                # Process each file
-                result = {}
+        for file_name in os.listdir(self.cache_dir):
+            day = file_name[len(prefix):len(prefix) + 8]
+            if not file_name.startswith(prefix) or not file_name[len(prefix) + 8:].startswith(suffix) or not day.isdigit():
+                continue
 
-                for i, file_name in enumerate(file_list):
-                    with zip_file.open(file_name) as file:
-                        try:
-                            dt = self._extract_xml_time(file)
+            day = datetime.strptime(day, "%Y%m%d").date()
+            if day < oldest and day != keep:
+                os.remove(os.path.join(self.cache_dir, file_name))
+                print("Removed cached", file_name)
 
-                            if dt is None:
-                                print(f"Failed to extract time from file {file_name}")
-                                continue
-                            elif dt not in result:
-                                result[dt] = self.parse_xml(file)
-                        except Exception as e:
-                            print(f"Failed to parse XML file {file_name}. Error: {e}")
-                            continue
+    def _index_zip(self, zip_file):
+        # start time -> [(creation time, file name)] with the winning revision first, built from the file headers only
+        index = {}
 
-                        if i % 10 == 0:
-                            print("Processing file", i, len(file_list))
+        for file_name in sorted(zip_file.namelist(), reverse=True):
+            with zip_file.open(file_name) as file:
+                try:
+                    start_utc, creation_utc = self._extract_xml_header(file)
+                except Exception as e:
+                    print(f"Failed to parse XML file {file_name}. Error: {e}")
+                    continue
 
-                return list(result.values())
+            if start_utc is None:
+                print(f"Failed to extract time from file {file_name}")
+                continue
 
-        else:
-            print(f"Failed to download ZIP. HTTP Status Code: {r.status_code}")
+            index.setdefault(start_utc, []).append((creation_utc or datetime.min, file_name))
+
+        return {start_utc: sorted(revisions, reverse=True) for start_utc, revisions in index.items()}
+
+    def _parse_cmols(self, zip_file, index, streaming, executor=None):
+        # start time -> (parsed revision, CMOL), only the winning revision per start time is parsed, the next one only if it fails
+        submit = executor.submit if executor is not None else _run_inline
 
-    def _extract_xml_time(self, xml):
-        header = xml.read(1000).decode("utf-8")
+        result = {}
+        while index:
+            jobs = {}
+            for dt, revisions in index.items():
+                revision = revisions.pop(0)
+                jobs[dt] = (revision, submit(_parse_cmol_content, zip_file.read(revision[1]), streaming))
+
+            for i, (dt, (revision, job)) in enumerate(jobs.items()):
+                try:
+                    result[dt] = (revision, job.result())
+                except Exception as e:
+                    print(f"Failed to parse XML file {revision[1]}. Error: {e}")
+
+                if i % 10 == 0:
+                    print("Processing file", i, len(jobs))
+
+            index = {dt: revisions for dt, revisions in index.items() if dt not in result and len(revisions) > 0}
+
+        return result
+
+    def _extract_xml_header(self, xml):
+        header = xml.read(1000).decode("utf-8", errors="ignore")
         match = re.search(r"<start>(.*?)</start>.*?<end>(.*?)</end>", header, re.DOTALL)
+        created_match = re.search(r"<createdDateTime>(.*?)</createdDateTime>", header)
 
-        xml.seek(0) # reset file pointer
+        start_utc = datetime.strptime(match.group(1), "%Y-%m-%dT%H:%MZ") if match else None
+        creation_utc = datetime.strptime(created_match.group(1), "%Y-%m-%dT%H:%M:%SZ") if created_match else None
 
-        if match:
-            start_time, end_time = match.groups()
-            return datetime.strptime(start_time, "%Y-%m-%dT%H:%MZ")
-        else:
-            return None
+        return start_utc, creation_utc
 
+    @staticmethod
+    def parse_xml(xml, streaming=False):
+        # needs no instance, so the worker processes do not create writers or database sinks
+        if streaming:
+            return CMOL.from_events(TransnetAPI._iter_xml_events(xml))
 
-    def parse_xml(self, xml):
         xml_content = xml.read()#.decode('utf-8').replace('?"', '"')
 
         if xml_content.startswith(b'<xml'):
@@ -111,49 +304,68 @@ class TransnetAPI:
 
         return CMOL.from_xml(root)
 
-    def _build_lmol_df(self, cmols, quantiles):
-        result = {}
+    @staticmethod
+    def _iter_xml_events(xml, chunk_size=64 * 1024):
+        # incremental equivalent of parse_xml's ET.fromstring, applying the same fixes to the malformed '<xml' wrapper chunk by chunk
+        parser = ET.XMLPullParser(events=("start", "end"))
 
-        for cmol in cmols:
-            if cmol.start_utc not in result or cmol.creation_utc > result[cmol.start_utc].creation_utc:
-                result[cmol.start_utc] = cmol
+        chunk = xml.read(max(chunk_size, len(b'<xml')))
+        wrapped = chunk.startswith(b'<xml')
+        carry = b"" # trailing '?' that may pair with a '"' in the next chunk
+        tail = b""
 
-        df = pd.concat([cmol.to_lmol_df(quantiles=quantiles) for cmol in result.values()])
-        return df
-
-    def _build_cmol_df(self, cmols, quantiles):
-        result = {}
+        while chunk:
+            if wrapped:
+                chunk = carry + chunk
+                carry = b"?" if chunk.endswith(b"?") else b""
+                chunk = chunk[:len(chunk) - len(carry)].replace(b'?"', b'"')
 
-        for cmol in cmols:
-            if cmol.start_utc not in result or cmol.creation_utc > result[cmol.start_utc].creation_utc:
-                result[cmol.start_utc] = cmol
+            parser.feed(chunk)
+            yield from parser.read_events()
 
-        df = pd.concat([cmol.to_cmol_df(quantiles=quantiles) for cmol in result.values()])
-        return df
+            tail = (tail + chunk)[-16:]
+            chunk = xml.read(chunk_size)
 
-    def upload_lmols(self, cmols):
-        df = self._build_lmol_df(cmols, MOL_QUANTILES)
+        if wrapped:
+            parser.feed(carry)
+            tail = (tail + carry)[-16:]
 
-        data_cols = [col for col in df.columns if col.startswith("UP_") or col.startswith("DOWN_")]
+            if not tail.endswith(b"</xml>\r\n\n"):
+                parser.feed(b"</xml>\r\n\n")
 
-        print("Uploading LMOLs to NXTDatabase")
-        NXTDatabase.energy().bulk_upsert(df, "PICASSO_LMOL", key_cols=["UTCTIME", "REGION"], data_cols=data_cols, moddate_col="CREATIONDATE")
+        parser.close()
+        yield from parser.read_events()
 
-        print("Uploading LMOLs to HexatradersDatabase")
-        HexatradersDatabase.get_instance().bulk_upsert(df, "traders.PICASSO_LMOL", key_cols=["UTCTIME", "REGION"], data_cols=[d for d in data_cols if d != 'CREATIONDATE'], moddate_col="CREATIONDATE")
+    def _build_mol_dfs(self, cmols, quantiles):
+        # latest revision per quarter-hour, each one transformed once into both its LMOL and CMOL rows
+        result = {}
 
+        for cmol in cmols:
+            if cmol.start_utc not in result or cmol.creation_utc > result[cmol.start_utc].creation_utc:
+                result[cmol.start_utc] = cmol
 
-    def upload_cmols(self, cmols):
-        df = self._build_cmol_df(cmols, MOL_QUANTILES)
+        mol_dfs = [cmol.to_mol_dfs(quantiles=quantiles) for cmol in result.values()]
+        return pd.concat([lmol_df for lmol_df, _ in mol_dfs]), pd.concat([cmol_df for _, cmol_df in mol_dfs])
 
-        data_cols = [col for col in df.columns if col.startswith("UP_") or col.startswith("DOWN_")]
+    def upload_mols(self, cmols, on_written=None, on_failed=None):
+        lmol_df, cmol_df = self._build_mol_dfs(cmols, MOL_QUANTILES)
 
-        print("Uploading CMOLs to NXTDatabase")
-        NXTDatabase.energy().bulk_upsert(df, "PICASSO_CMOL", key_cols=["UTCTIME"], data_cols=data_cols, moddate_col="CREATIONDATE")
+        print("Uploading LMOLs and CMOLs to NXTDatabase and HexatradersDatabase")
+        self.writer.write_many(self._lmol_writes(lmol_df) + self._cmol_writes(cmol_df), on_written=on_written, on_failed=on_failed)
 
-        print("Uploading CMOLs to HexatradersDatabase")
-        HexatradersDatabase.get_instance().bulk_upsert(df, "traders.PICASSO_CMOL", key_cols=["UTCTIME"], data_cols=[d for d in data_cols if d != 'CREATIONDATE'], moddate_col="CREATIONDATE")
+    def _lmol_writes(self, df):
+        data_cols = [col for col in df.columns if col.startswith("UP_") or col.startswith("DOWN_")]
+        return [
+            (TableSink(NXTDatabase.energy(), "PICASSO_LMOL", key_cols=["UTCTIME", "REGION"], data_cols=data_cols), df),
+            (TableSink(HexatradersDatabase.get_instance(), "traders.PICASSO_LMOL", key_cols=["UTCTIME", "REGION"], data_cols=data_cols), df),
+        ]
 
+    def _cmol_writes(self, df):
+        data_cols = [col for col in df.columns if col.startswith("UP_") or col.startswith("DOWN_")]
+        return [
+            (TableSink(NXTDatabase.energy(), "PICASSO_CMOL", key_cols=["UTCTIME"], data_cols=data_cols), df),
+            (TableSink(HexatradersDatabase.get_instance(), "traders.PICASSO_CMOL", key_cols=["UTCTIME"], data_cols=data_cols), df),
+        ]
 
     def upload_cbmp(self, df):
         print(df)
@@ -178,10 +390,25 @@ class TransnetAPI:
         df = df.groupby("QUARTERHOUR").agg(agg).reset_index()
         df = df[df["UTCTIME"] >= 225].drop(columns="UTCTIME").rename(columns={"QUARTERHOUR": "UTCTIME"})
 
-        NXTDatabase.energy().bulk_upsert(df, "PICASSO_EXCHANGED_VOLUMES", key_cols=["UTCTIME"], data_cols=list(data_cols), moddate_col="CREATIONDATE")
+        self.writer.write(df, [
+            TableSink(NXTDatabase.energy(), "PICASSO_EXCHANGED_VOLUMES", key_cols=["UTCTIME"], data_cols=data_cols),
+            TableSink(HexatradersDatabase.get_instance(), "traders.PICASSO_EXCHANGED_VOLUMES", key_cols=["UTCTIME"], data_cols=data_cols, columns={"50Hz_UP": 'TSO_50HZ_UP', "50Hz_DOWN": 'TSO_50HZ_DOWN'}),
+        ])
+
+
+def _parse_cmol_content(content, streaming):
+    # runs in the worker processes: only the bid book is sent back, not the per-bid objects
+    cmol = TransnetAPI.parse_xml(BytesIO(content), streaming=streaming)
+    return CMOL(creation_utc=cmol.creation_utc, start_utc=cmol.start_utc, end_utc=cmol.end_utc, bids=None, book=cmol.book)
+
 
-        df = df.rename(columns={"50Hz_UP": 'TSO_50HZ_UP', "50Hz_DOWN": 'TSO_50HZ_DOWN'})
-        HexatradersDatabase.get_instance().bulk_upsert(df, "traders.PICASSO_EXCHANGED_VOLUMES", key_cols=["UTCTIME"], data_cols=[col for col in df.columns if col.endswith("UP") or col.endswith("DOWN")], moddate_col="CREATIONDATE")
+def _run_inline(fn, *args):
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
 
 
 if __name__ == "__main__":
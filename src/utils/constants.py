@@ -5,4 +5,5 @@ import pytz
 LOCALTZ = pytz.timezone('Europe/Brussels')
 
 ROOT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-CONFIG_PATH = os.path.join(ROOT_PATH, "config")
\ No newline at end of file
+CONFIG_PATH = os.path.join(ROOT_PATH, "config")
+CACHE_PATH = os.path.join(ROOT_PATH, "cache")
\ No newline at end of file
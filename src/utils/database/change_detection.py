@@ -0,0 +1,107 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class RowDigestCache:
+    # Remembers, per target table, a 64-bit hash of the data columns of every key that was written successfully,
+    # so that re-upserting overlapping windows only sends the keys that are new or whose values changed.
+    # Tables are identified by (namespace, table, key_cols, data_cols) so that the same table name on two databases,
+    # or with a different set of data columns, never shares digests.
+    _instance = None
+
+    @staticmethod
+    def get_instance():
+        if RowDigestCache._instance is None:
+            RowDigestCache._instance = RowDigestCache()
+        return RowDigestCache._instance
+
+    def __init__(self, cache_dir=None, max_keys=2_000_000):
+        self.cache_dir = cache_dir
+        self.max_keys = max_keys # per table, the oldest written keys are dropped first
+
+        self._digests = {}
+        self._lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _hash(df, cols):
+        return pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+
+    def changed_rows(self, namespace, table, df, key_cols, data_cols):
+        # returns the rows of df that are not known to be in the table with the same values,
+        # together with the digest to pass to update() once they are written
+        cache_key = (namespace, table, tuple(key_cols), tuple(data_cols))
+        key_hashes = self._hash(df, key_cols)
+        data_hashes = self._hash(df, data_cols)
+
+        digests = self._get(cache_key)
+        positions = digests.index.get_indexer(key_hashes)
+        known = positions >= 0
+
+        changed = ~known
+        changed[known] = digests.to_numpy()[positions[known]] != data_hashes[known]
+
+        return df[changed], (cache_key, key_hashes[changed], data_hashes[changed])
+
+    def update(self, digest):
+        cache_key, key_hashes, data_hashes = digest
+        if len(key_hashes) == 0:
+            return
+
+        written = pd.Series(data_hashes, index=key_hashes)
+        written = written[~written.index.duplicated(keep="last")]
+
+        with self._lock:
+            digests = self._digests.get(cache_key, self._empty())
+            digests = pd.concat([digests[~digests.index.isin(written.index)], written])
+            if len(digests) > self.max_keys:
+                digests = digests.iloc[-self.max_keys:]
+            self._digests[cache_key] = digests
+
+            if self.cache_dir is not None:
+                self._save(cache_key, digests)
+
+    def clear(self, table=None):
+        with self._lock:
+            for cache_key in [k for k in self._digests if table is None or k[1] == table]:
+                del self._digests[cache_key]
+                if self.cache_dir is not None and os.path.exists(self._get_cache_path(cache_key)):
+                    os.remove(self._get_cache_path(cache_key))
+
+    @staticmethod
+    def _empty():
+        return pd.Series(np.array([], dtype=np.uint64), index=pd.Index(np.array([], dtype=np.uint64)))
+
+    def _get(self, cache_key):
+        with self._lock:
+            if cache_key not in self._digests:
+                self._digests[cache_key] = self._load(cache_key) if self.cache_dir is not None else self._empty()
+            return self._digests[cache_key]
+
+    def _get_cache_path(self, cache_key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(cache_key).encode()).hexdigest() + ".npz")
+
+    def _load(self, cache_key):
+        path = self._get_cache_path(cache_key)
+        if not os.path.exists(path):
+            return self._empty()
+
+        try:
+            with np.load(path) as data:
+                return pd.Series(data["data"], index=pd.Index(data["keys"]))
+        except Exception as e:
+            print("Could not load row digests for", cache_key[1], e)
+            return self._empty()
+
+    def _save(self, cache_key, digests):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, keys=digests.index.to_numpy(), data=digests.to_numpy())
+        os.replace(tmp_path, self._get_cache_path(cache_key))
@@ -1,11 +1,16 @@
+import datetime
 import os
 from os import getenv
 
 import pandas as pd
+import pytz
 import sqlalchemy.engine
 from dotenv import load_dotenv
+from sqlalchemy import text
 from elindus_utils.msdatabase.MSDatabase import MSDatabase as MSDatabaseElindus
 
+from src.utils.database.change_detection import RowDigestCache
+
 
 # pip install python-dotenv
 # INDIEN GEEN .env FILE
@@ -15,6 +20,7 @@ class MSDatabaseAbstract(MSDatabaseElindus):
 
     def __init__(self, **kwargs):
         self.loaded_env = False
+        self._statements = {}
         super().__init__(**kwargs)
 
     def load_specific_env(self):
@@ -30,6 +36,40 @@ class MSDatabaseAbstract(MSDatabaseElindus):
     def query(self, sql: str) -> pd.DataFrame:
         return self.get_pandas_df(sql)
 
+    def query_params(self, sql: str, params: dict = None, dtypes: dict = None) -> pd.DataFrame:
+        # :name parameters are bound instead of formatted into the sql, so the statement text is the same on every call
+        # and SQL Server reuses its plan. dtypes fixes the column types, also when the result is empty.
+        statement = self._statements.get(sql)
+        if statement is None:
+            statement = self._statements[sql] = text(sql)
+
+        params = {name: self._to_param(value) for name, value in (params or {}).items()}
+        return self.retry(lambda: pd.read_sql_query(statement, self.get_engine(), params=params, dtype=dtypes))
+
+    @staticmethod
+    def _to_param(value):
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            value = value.astimezone(pytz.utc).replace(tzinfo=None)
+        if isinstance(value, pd.Timestamp):
+            return value.to_pydatetime()
+        return value.item() if hasattr(value, "item") else value # numpy scalars
+
+    def bulk_upsert(self, df, table='', key_cols=[], data_cols=[], moddate_col=None, conn=None, skip_unchanged=False):
+        # skip_unchanged: only send keys that are new or changed since the last successful upsert from this process,
+        # digests are only remembered when the upsert commits itself (conn is None)
+        if not skip_unchanged:
+            return super().bulk_upsert(df, table, key_cols, data_cols, moddate_col, conn)
+
+        total = len(df)
+        df, digest = RowDigestCache.get_instance().changed_rows(type(self).__name__, table, df, key_cols, data_cols)
+        print(f"{table}: {len(df)} of {total} rows new or changed")
+        if len(df) == 0:
+            return
+
+        super().bulk_upsert(df, table, key_cols, data_cols, moddate_col, conn)
+        if conn is None:
+            RowDigestCache.get_instance().update(digest)
+
     def delete(self, table: str, where: str = None) -> sqlalchemy.engine.CursorResult:
         sql = f"DELETE FROM {table}"
         if where is not None:
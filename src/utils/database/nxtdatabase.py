@@ -1,6 +1,8 @@
 import datetime
 import json
 import os
+import tempfile
+import time
 
 import numpy as np
 import pandas as pd
@@ -9,6 +11,8 @@ import pytz
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
+from src.utils.database.change_detection import RowDigestCache
+
 class NXTDatabase:
 
     _instance_energy = None
@@ -37,6 +41,7 @@ class NXTDatabase:
         self.database = database
 
         self._engine = None
+        self._bulk_engine = None
 
     @property
     def engine(self):
@@ -48,10 +53,21 @@ class NXTDatabase:
 
         return self._engine
 
+    @property
+    def bulk_engine(self):
+        # only for bulk_load_upsert: the client allows LOAD DATA LOCAL INFILE on these connections
+        if self._bulk_engine is None:
+            self._bulk_engine = create_engine('mysql+pymysql://' + self.user + ':' + self.password + '@' + self.server + ':3306/' + self.database, pool_recycle=60 * 5, pool_pre_ping=True, connect_args={"local_infile": True})
+
+        return self._bulk_engine
+
     def close(self):
         if not self._engine is None:
             self._engine.dispose()
             self._engine = None
+        if not self._bulk_engine is None:
+            self._bulk_engine.dispose()
+            self._bulk_engine = None
 
     def get_engine(self):
         return self.engine
@@ -132,27 +148,126 @@ class NXTDatabase:
             con.execute(query, params)
             t.commit()
 
-    def bulk_upsert(self, df, table, key_cols, data_cols, moddate_col=None):
-        df = df.copy()
-        if not moddate_col is None:
-            df[moddate_col] = datetime.datetime.utcnow()
-            data_cols += [moddate_col]
+    def bulk_upsert(self, df, table, key_cols, data_cols, moddate_col=None, chunksize=5000, single_transaction=True, skip_unchanged=False):
+        # skip_unchanged: only send keys that are new or changed since the last successful upsert from this process
+        digest = None
+        if skip_unchanged:
+            total = len(df)
+            df, digest = RowDigestCache.get_instance().changed_rows(f"{self.server}/{self.database}", table, df, key_cols, data_cols)
+            print(f"{table}: {len(df)} of {total} rows new or changed")
 
-        update_str = ",".join(f'{table}.{col} = t.{col}' for col in data_cols)
-        value_str = "),(".join([",".join(["'" + str(row[k]) + "'" if not pd.isnull(row[k]) else 'NULL' for k in key_cols + data_cols]) for i, row in df[key_cols + data_cols].iterrows()])
-
-        upsert_query = f"""
-            INSERT INTO {table} ({",".join(key_cols + data_cols)})
-            VALUES ({value_str}) as t({",".join(key_cols + data_cols)})
-            ON DUPLICATE KEY UPDATE 
-            {update_str}
-        """
-
-        # Execute the upsert query
-        with self.engine.connect() as conn:
-            t = conn.begin()
-            conn.execute(text(upsert_query))
-            t.commit()
+        if len(df) == 0:
+            return
+
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for sql, params in self._upsert_statements(df, table, key_cols, data_cols, moddate_col, chunksize):
+                cursor.execute(sql, params)
+
+                if not single_transaction:
+                    connection.commit()
+
+            cursor.close()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        if digest is not None:
+            RowDigestCache.get_instance().update(digest)
+
+    def _upsert_statements(self, df, table, key_cols, data_cols, moddate_col, chunksize):
+        # parameterized multi-row upserts of at most chunksize rows, NaN/NaT are sent as NULL
+        update_cols = data_cols + ([moddate_col] if moddate_col is not None else [])
+        cols = key_cols + update_cols
+
+        columns = [df[col].astype(object).where(df[col].notna(), None).tolist() for col in key_cols + data_cols]
+        if moddate_col is not None:
+            columns.append([datetime.datetime.utcnow()] * len(df))
+        rows = list(zip(*columns))
+
+        update_str = ",".join(f'{table}.{col} = t.{col}' for col in update_cols)
+        row_str = "(" + ",".join(["%s"] * len(cols)) + ")"
+
+        for start in range(0, len(rows), chunksize):
+            chunk = rows[start:start + chunksize]
+
+            upsert_query = f"""
+                INSERT INTO {table} ({",".join(cols)})
+                VALUES {",".join([row_str] * len(chunk))} as t({",".join(cols)})
+                ON DUPLICATE KEY UPDATE
+                {update_str}
+            """
+
+            yield upsert_query, [value for row in chunk for value in row]
+
+    def bulk_load_upsert(self, df, table, key_cols, data_cols, moddate_col=None):
+        # For backfills: streams df as CSV into an index-less temporary staging table (LOAD DATA LOCAL INFILE on the bulk_engine,
+        # needs local_infile enabled on the server) and merges it with a single INSERT ... SELECT ... ON DUPLICATE KEY UPDATE
+        if len(df) == 0:
+            return None
+
+        update_cols = data_cols + ([moddate_col] if moddate_col is not None else [])
+        cols = key_cols + update_cols
+        staging = "TMP_" + table.split(".")[-1]
+
+        data = df[key_cols + data_cols].copy()
+        if moddate_col is not None:
+            data[moddate_col] = datetime.datetime.utcnow()
+
+        metrics = {"rows": len(data)}
+
+        t = time.time()
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".csv", newline="", delete=False) as f:
+            data[cols].to_csv(f, header=False, index=False, na_rep="\\N", date_format="%Y-%m-%d %H:%M:%S.%f")
+            csv_path = f.name
+        metrics["csv_seconds"] = time.time() - t
+
+        update_str = ",".join(f'{table}.{col} = t.{col}' for col in update_cols)
+
+        connection = self.bulk_engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+            cursor.execute(f"CREATE TEMPORARY TABLE {staging} SELECT {','.join(cols)} FROM {table} LIMIT 0")
+
+            t = time.time()
+            cursor.execute(f"""
+                LOAD DATA LOCAL INFILE %s INTO TABLE {staging}
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+                LINES TERMINATED BY '\\n'
+                ({",".join(cols)})
+            """, (csv_path,))
+            metrics["load_seconds"] = time.time() - t
+
+            t = time.time()
+            cursor.execute(f"""
+                INSERT INTO {table} ({",".join(cols)})
+                SELECT * FROM (SELECT {",".join(cols)} FROM {staging}) as t
+                ON DUPLICATE KEY UPDATE
+                {update_str}
+            """)
+            metrics["merge_seconds"] = time.time() - t
+
+            cursor.execute(f"DROP TEMPORARY TABLE {staging}")
+            cursor.close()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+            os.remove(csv_path)
+
+        total = metrics["csv_seconds"] + metrics["load_seconds"] + metrics["merge_seconds"]
+        metrics["rows_per_second"] = metrics["rows"] / max(total, 1e-6)
+
+        print(f"{table}: {metrics['rows']} rows loaded in {total:.1f}s ({metrics['rows_per_second']:,.0f} rows/s, "
+              f"csv {metrics['csv_seconds']:.1f}s, load {metrics['load_seconds']:.1f}s, merge {metrics['merge_seconds']:.1f}s)")
+        return metrics
 
 if __name__ == "__main__":
     db = NXTDatabase.energy()
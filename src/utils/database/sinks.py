@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SinkWriteError(Exception):
+    def __init__(self, failures):
+        # failures: {sink name: exception}, the other sinks of the same write did succeed
+        self.failures = failures
+        super().__init__("Write failed for " + ", ".join(f"{name} ({type(e).__name__}: {e})" for name, e in failures.items()))
+
+
+class TableSink:
+    # One target table of an upsert. key_cols and data_cols are named as in the frames that are written,
+    # columns optionally maps those names to the column names of this table.
+    def __init__(self, database, table, key_cols, data_cols, moddate_col="CREATIONDATE", columns=None, skip_unchanged=True, bulk_load=False):
+        self.database = database
+        self.table = table
+        self.key_cols = key_cols
+        self.data_cols = data_cols
+        self.moddate_col = moddate_col
+        self.columns = columns or {}
+        self.skip_unchanged = skip_unchanged
+        self.bulk_load = bulk_load # NXTDatabase only, for backfills
+
+    def __str__(self):
+        return f"{type(self.database).__name__}:{self.table}"
+
+    def _key(self):
+        return id(self.database), self.table, tuple(self.key_cols), tuple(self.data_cols), self.moddate_col, tuple(self.columns.items()), self.skip_unchanged, self.bulk_load
+
+    def __eq__(self, other):
+        return isinstance(other, TableSink) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def write(self, df):
+        df = df.rename(columns=self.columns) if self.columns else df
+        key_cols = [self.columns.get(col, col) for col in self.key_cols]
+        data_cols = [self.columns.get(col, col) for col in self.data_cols]
+
+        if self.bulk_load:
+            self.database.bulk_load_upsert(df, self.table, key_cols=key_cols, data_cols=data_cols, moddate_col=self.moddate_col)
+        else:
+            self.database.bulk_upsert(df, self.table, key_cols=key_cols, data_cols=data_cols, moddate_col=self.moddate_col, skip_unchanged=self.skip_unchanged)
+
+
+class MultiSinkWriter:
+    # Fans frames out to several sinks in parallel, a failing sink does not stop the others
+    _instance = None
+
+    @staticmethod
+    def get_instance():
+        if MultiSinkWriter._instance is None:
+            MultiSinkWriter._instance = MultiSinkWriter()
+        return MultiSinkWriter._instance
+
+    def __init__(self, max_workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sink")
+
+    def write(self, df, sinks, on_written=None, on_failed=None):
+        self.write_many([(sink, df) for sink in sinks], on_written=on_written, on_failed=on_failed)
+
+    def write_many(self, writes, on_written=None, on_failed=None):
+        # writes: [(sink, df)], calls on_failed and raises SinkWriteError once all writes are done if any of them failed,
+        # otherwise calls on_written (same interface as WriteBehindQueue)
+        futures = [(sink, self.executor.submit(sink.write, df)) for sink, df in writes if df is not None and len(df) > 0]
+
+        failures = {}
+        for sink, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Write to {sink} failed: {e}")
+                failures[str(sink)] = e
+
+        if len(failures) > 0:
+            if on_failed is not None:
+                on_failed()
+            raise SinkWriteError(failures)
+
+        if on_written is not None:
+            on_written()
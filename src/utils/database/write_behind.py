@@ -0,0 +1,193 @@
+import atexit
+import threading
+import time
+
+import pandas as pd
+
+from src.utils.database.sinks import MultiSinkWriter, SinkWriteError
+
+
+class WriteBehindQueue:
+    # Takes the same writes as MultiSinkWriter but returns immediately, a background thread sends them.
+    # Pending frames for the same sink are coalesced into one upsert (the last row per key wins), and writers block
+    # once max_pending_rows are queued or being written for one of their sinks (backpressure per sink). A failed sink
+    # is retried after retry_delay while the other sinks keep being written, after max_attempts its rows are dropped.
+    _instance = None
+
+    @staticmethod
+    def get_instance():
+        if WriteBehindQueue._instance is None:
+            WriteBehindQueue._instance = WriteBehindQueue()
+            atexit.register(WriteBehindQueue._instance.close)
+        return WriteBehindQueue._instance
+
+    def __init__(self, writer=None, max_pending_rows=1_000_000, retry_delay=30, max_attempts=10):
+        self.writer = writer if writer is not None else MultiSinkWriter.get_instance()
+        self.max_pending_rows = max_pending_rows
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+
+        self._pending = {} # sink -> ([df], [callback ticket])
+        self._rows = {} # sink -> rows queued or being written
+        self._failed = {} # sink -> (failed attempts in a row, time of the next attempt)
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def write(self, df, sinks, on_written=None, on_failed=None):
+        self.write_many([(sink, df) for sink in sinks], on_written=on_written, on_failed=on_failed)
+
+    def write_many(self, writes, on_written=None, on_failed=None):
+        # on_written is called from the background thread once every sink of these writes has been written,
+        # on_failed instead if the rows of one of them were dropped
+        writes = [(sink, df) for sink, df in writes if df is not None and len(df) > 0]
+        rows = {}
+        for sink, df in writes:
+            rows[sink] = rows.get(sink, 0) + len(df)
+        ticket = _Ticket(len(writes), on_written, on_failed)
+
+        with self._condition:
+            if self._closed:
+                raise Exception("WriteBehindQueue is closed")
+
+            while any(0 < self._rows.get(sink, 0) and self._rows.get(sink, 0) + n > self.max_pending_rows for sink, n in rows.items()):
+                self._condition.wait()
+
+            for sink, df in writes:
+                frames, tickets = self._pending.setdefault(sink, ([], []))
+                frames.append(df)
+                tickets.append(ticket)
+            for sink, n in rows.items():
+                self._rows[sink] = self._rows.get(sink, 0) + n
+            self._condition.notify_all()
+
+        if len(writes) == 0:
+            ticket.done()
+
+    def flush(self, timeout=None):
+        # waits until everything queued so far is written, returns False on timeout
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while sum(self._rows.values()) > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=120):
+        if not self.flush(timeout):
+            print(f"WriteBehindQueue closed with {sum(self._rows.values())} rows not written")
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    now = time.time()
+                    # sinks waiting for a retry are left out, so they don't hold up the others
+                    ready = [sink for sink in self._pending if sink not in self._failed or self._failed[sink][1] <= now]
+                    if len(ready) > 0:
+                        break
+                    retry_at = min((self._failed[sink][1] for sink in self._pending), default=None)
+                    self._condition.wait(None if retry_at is None else retry_at - now)
+                if self._closed:
+                    return
+
+                batch, dropped = {}, {}
+                for sink in ready:
+                    frames, tickets = self._pending.pop(sink)
+                    rows = sum(len(df) for df in frames)
+                    try:
+                        batch[sink] = (self._coalesce(sink, frames), tickets, rows)
+                    except Exception as e:
+                        # e.g. frames without the key columns, dropped like a failed write so the other sinks go on
+                        self._failed.pop(sink, None)
+                        dropped[sink] = (tickets, rows)
+                        print(f"Write behind could not combine the frames for {sink} ({type(e).__name__}: {e}), dropping {rows} rows")
+
+            failures = {}
+            try:
+                if len(batch) > 0:
+                    self.writer.write_many([(sink, df) for sink, (df, _, _) in batch.items()])
+            except SinkWriteError as e:
+                failures = e.failures
+            except Exception as e:
+                print(f"Write behind failed: {e}")
+                failures = {str(sink): e for sink in batch}
+
+            for sink, (_, tickets, _) in batch.items():
+                if str(sink) not in failures:
+                    for ticket in tickets:
+                        ticket.done()
+
+            with self._condition:
+                for sink, (df, tickets, rows) in batch.items():
+                    if str(sink) not in failures:
+                        self._failed.pop(sink, None)
+                        self._release(sink, rows)
+                        continue
+
+                    attempts = self._failed.get(sink, (0, None))[0] + 1
+                    if attempts < self.max_attempts:
+                        # back in front of anything queued in the meantime, so newer rows still win
+                        frames, queued_tickets = self._pending.get(sink, ([], []))
+                        self._pending[sink] = ([df] + frames, tickets + queued_tickets)
+                        self._rows[sink] += len(df) - rows
+                        self._failed[sink] = (attempts, time.time() + self.retry_delay)
+                        print(f"Write behind failed for {sink} ({attempts}/{self.max_attempts}), retrying in {self.retry_delay}s")
+                    else:
+                        # rows queued after these get attempts of their own
+                        self._failed.pop(sink, None)
+                        dropped[sink] = (tickets, rows)
+                        print(f"Write behind failed for {sink} {attempts} times, dropping {len(df)} rows")
+
+                self._condition.notify_all()
+
+            if len(dropped) > 0:
+                for tickets, _ in dropped.values():
+                    for ticket in tickets:
+                        ticket.done(written=False)
+
+                with self._condition:
+                    for sink, (_, rows) in dropped.items():
+                        self._release(sink, rows)
+                    self._condition.notify_all()
+
+    def _release(self, sink, rows):
+        # called holding the condition, once rows of sink were written or dropped
+        self._rows[sink] -= rows
+        if self._rows[sink] == 0:
+            del self._rows[sink]
+
+    @staticmethod
+    def _coalesce(sink, frames):
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        return df.drop_duplicates(subset=sink.key_cols, keep="last")
+
+
+class _Ticket:
+    def __init__(self, remaining, callback, on_failed=None):
+        self.remaining = remaining
+        self.callback = callback
+        self.on_failed = on_failed
+        self.written = True
+        self._lock = threading.Lock()
+
+    def done(self, written=True):
+        with self._lock:
+            self.remaining -= 1
+            self.written = self.written and written
+            callback = self.callback if self.written else self.on_failed
+            if self.remaining > 0 or callback is None:
+                return
+
+        try:
+            callback()
+        except Exception as e:
+            print(f"Write behind callback failed: {e}")
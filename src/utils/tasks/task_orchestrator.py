@@ -8,6 +8,8 @@ import croniter as croniter
 import pyodbc
 
 from src.utils.constants import LOCALTZ
+from src.utils.database.sinks import MultiSinkWriter
+from src.utils.database.write_behind import WriteBehindQueue
 
 
 class NoDataException(Exception):
@@ -21,7 +23,8 @@ class RetryException(Exception):
 class Task:
 
     # frequency in seconds; executiontime "%H:%M:%S" LOCAL TIME
-    def __init__(self, frequency: int=None, executiontime: str=None, cron: str=None, task=None, task_name=None):
+    # write_behind: uploads are queued and written in the background while the next execution fetches and computes
+    def __init__(self, frequency: int=None, executiontime: str=None, cron: str=None, task=None, task_name=None, write_behind=False):
         self._frequency = frequency
         self._executiontime = executiontime
         self._cron = cron
@@ -38,6 +41,7 @@ class Task:
                             " exactly one of the parameters should be initialized")
 
         self._task = task
+        self.writer = WriteBehindQueue.get_instance() if write_behind else MultiSinkWriter.get_instance()
 
         if task_name is None:
             task_name = task.__name__
@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from src.utils.database.change_detection import RowDigestCache
+
+KEY_COLS = ["UTCTIME", "AREA"]
+DATA_COLS = ["VOLUME", "PRICE"]
+
+
+def frame(prices, volumes=None):
+    return pd.DataFrame({
+        "UTCTIME": pd.date_range("2024-06-21", periods=len(prices), freq="15min"),
+        "AREA": "BE",
+        "VOLUME": volumes if volumes is not None else [1.0] * len(prices),
+        "PRICE": prices,
+        "COMMENT": "not a data column",
+    })
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RowDigestCache()
+    monkeypatch.setattr(RowDigestCache, "_instance", cache)
+    return cache
+
+
+def changed(cache, df, namespace="db", table="T"):
+    return cache.changed_rows(namespace, table, df, KEY_COLS, DATA_COLS)
+
+
+def test_written_rows_are_skipped_until_their_data_changes(cache):
+    df = frame([10.0, 20.0, 30.0])
+    rows, digest = changed(cache, df)
+    assert len(rows) == 3
+    cache.update(digest)
+
+    # unchanged data columns, other columns are not compared
+    rows, _ = changed(cache, df.assign(COMMENT="changed"))
+    assert len(rows) == 0
+
+    # a changed price, a changed volume and a new key
+    rows, digest = changed(cache, frame([10.0, 21.0, 30.0, 40.0], volumes=[1.0, 1.0, 2.0, 1.0]))
+    assert list(rows["PRICE"]) == [21.0, 30.0, 40.0]
+    cache.update(digest)
+    assert len(changed(cache, frame([10.0, 21.0, 30.0, 40.0], volumes=[1.0, 1.0, 2.0, 1.0]))[0]) == 0
+
+    # changing back is a change too
+    assert list(changed(cache, df)[0]["PRICE"]) == [20.0, 30.0]
+
+
+def test_rows_are_not_skipped_before_update(cache):
+    df = frame([10.0, 20.0])
+    changed(cache, df)
+
+    # not written (yet): sent again
+    assert len(changed(cache, df)[0]) == 2
+
+
+def test_tables_do_not_share_digests(cache):
+    df = frame([10.0, 20.0])
+    cache.update(changed(cache, df)[1])
+
+    assert len(changed(cache, df, namespace="other db")[0]) == 2
+    assert len(changed(cache, df, table="U")[0]) == 2
+    assert len(cache.changed_rows("db", "T", df, KEY_COLS, ["PRICE"])[0]) == 2
+
+
+def test_oldest_keys_are_dropped_over_max_keys():
+    cache = RowDigestCache(max_keys=2)
+    cache.update(changed(cache, frame([10.0, 20.0, 30.0]))[1])
+
+    assert list(changed(cache, frame([10.0, 20.0, 30.0]))[0]["PRICE"]) == [10.0]
+
+
+def test_digests_are_kept_in_cache_dir(tmp_path):
+    df = frame([10.0, 20.0])
+    cache = RowDigestCache(cache_dir=str(tmp_path))
+    cache.update(changed(cache, df)[1])
+
+    assert len(changed(RowDigestCache(cache_dir=str(tmp_path)), df)[0]) == 0
+
+    cache.clear("T")
+    assert len(changed(cache, df)[0]) == 2
+    assert len(changed(RowDigestCache(cache_dir=str(tmp_path)), df)[0]) == 2
@@ -0,0 +1,74 @@
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model.cmol.cmol import CMOL, BID_BOOK_DTYPE
+from src.model.cmol.cmol_types import FlowDirection, MarketObjectStatus
+
+QUANTILES = (0, 0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.9, 1)
+
+
+def loop_marginal_prices(bids, quantiles, flow_direction):
+    # the former per-bid CMOL.transform_bids
+    result = {}
+
+    bids_sorted = sorted(bids, key=lambda x: x.price if flow_direction == "UP" else -x.price)
+    bids_volume = sum([bid.quantity for bid in bids_sorted if bid.status == MarketObjectStatus.AVAILABLE])
+
+    for quantile in quantiles:
+        level = quantile * bids_volume
+
+        max_price = None
+        quantity = 0
+        for bid in bids_sorted:
+            if quantity >= max(level, 1):
+                break
+
+            if bid.status == MarketObjectStatus.AVAILABLE:
+                max_price = bid.price
+                quantity += bid.quantity
+
+        result[str(int(1000*quantile))] = max_price if quantity > 0 else None
+
+    return result
+
+
+def random_bids(rnd):
+    # few distinct prices for ties, zero quantities, and integer totals so that levels hit cumulative quantities exactly,
+    # every CMOL has bids in both directions
+    directions = [FlowDirection.UP, FlowDirection.DOWN] + [rnd.choice([FlowDirection.UP, FlowDirection.DOWN]) for _ in range(rnd.randint(0, 40))]
+    return [SimpleNamespace(direction=direction,
+                            price=rnd.choice([-20.0, 0.0, 35.5, 80.0, 80.0, 120.25]),
+                            quantity=rnd.choice([0, 0, 0.5, 1, 1, 2, 5, 10]),
+                            status=rnd.choice([MarketObjectStatus.AVAILABLE, MarketObjectStatus.AVAILABLE, MarketObjectStatus.UNAVAILABLE]))
+            for direction in directions]
+
+
+def row(df):
+    return {col: None if pd.isna(value) else value for col, value in df.iloc[0].items()}
+
+
+@pytest.mark.parametrize("seed", range(500))
+def test_marginal_prices_match_per_bid_loop(seed):
+    bids = random_bids(random.Random(seed))
+    book = np.array([("BE", bid.direction, bid.status, bid.price, bid.quantity) for bid in bids], dtype=BID_BOOK_DTYPE)
+
+    lmol_df, cmol_df = CMOL(creation_utc=None, start_utc=None, end_utc=None, bids=None, book=book).to_mol_dfs(QUANTILES)
+
+    # a single region, so its LMOL row and the CMOL row have the same marginal prices
+    for direction in (FlowDirection.UP, FlowDirection.DOWN):
+        expected = loop_marginal_prices([bid for bid in bids if bid.direction == direction], QUANTILES, direction)
+        for df in (lmol_df, cmol_df):
+            assert {level: row(df)[f"{direction}_{level}"] for level in expected} == expected
+
+
+def test_marginal_prices_at_cumulative_boundaries():
+    prices = np.array([10.0, 20.0, 30.0])
+    cumulative = np.cumsum([2.0, 3.0, 5.0])
+
+    # a level reached exactly by a cumulative quantity takes no further bids, 1 MW is the minimum level
+    assert CMOL._marginal_prices(prices, cumulative, (0, 0.2, 0.5, 0.6, 1)) == {"0": 10.0, "200": 10.0, "500": 20.0, "600": 30.0, "1000": 30.0}
+    assert CMOL._marginal_prices(prices, np.zeros(3), (0, 1)) == {"0": None, "1000": None}
@@ -0,0 +1,70 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyodbc", exc_type=ImportError) # needs the unixODBC driver manager
+
+import src.intraday.intraday_trades as intraday_trades
+from src.intraday.delivery_areas import AREA_CODE_DTYPE
+from src.intraday.intraday_trades import IntradayTrades, EPEX_TRADE_DTYPES
+
+DAY = datetime.datetime(2024, 6, 21)
+
+
+def trade(id, start, minutes, price, volume):
+    start = DAY + datetime.timedelta(minutes=start)
+    return {"ID": id, "PRICE": price, "VOLUME": volume, "DELIVERYSTARTUTC": start, "DELIVERYENDUTC": start + datetime.timedelta(minutes=minutes),
+            "BUYERAREA": "BE", "SELLERAREA": "NL", "TRADETIMEUTC": start - datetime.timedelta(hours=1)}
+
+
+@pytest.fixture
+def trades(monkeypatch):
+    # quarter-hours and hours around midnight, a block 22:00-02:00 and a block over two midnights
+    trades = pd.DataFrame([
+        trade(1, 23 * 60, 60, 50.0, 10.0),
+        trade(2, 22 * 60, 4 * 60, 80.0, 5.0),
+        trade(3, 24 * 60, 15, 40.0, 2.0),
+        trade(4, 24 * 60 + 60, 60, 45.0, 4.0),
+        trade(5, 23 * 60 + 45, 26 * 60 + 30, 60.0, 1.0),
+        trade(6, 2 * 24 * 60 + 15, 15, 30.0, 3.0),
+    ]).astype(EPEX_TRADE_DTYPES)
+    trades = trades.assign(BUYERAREA=trades["BUYERAREA"].astype(AREA_CODE_DTYPE), SELLERAREA=trades["SELLERAREA"].astype(AREA_CODE_DTYPE))
+
+    def get_trades(from_utc, to_utc, start_to=None):
+        start, end = trades["DELIVERYSTARTUTC"], trades["DELIVERYENDUTC"]
+        return trades[(start >= from_utc) & (start < (start_to or to_utc)) & (end <= to_utc)].reset_index(drop=True)
+
+    monkeypatch.setattr(intraday_trades.HexatradersDatabase, "get_instance", staticmethod(lambda: None))
+    monkeypatch.setattr(intraday_trades.HexatradersDatabase_RO, "get_instance", staticmethod(lambda: None))
+    it = IntradayTrades(region="Belgium")
+    monkeypatch.setattr(it, "_get_epex_trades", get_trades)
+    monkeypatch.setattr(it, "_get_np_trades", lambda *args, **kwargs: get_trades(*args, **kwargs).iloc[:0])
+    return it
+
+
+def upserted(frames, key_cols):
+    # the rows left after upserting the frames in order
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset=key_cols, keep="last").sort_values(key_cols).reset_index(drop=True)
+
+
+def test_netborder_of_blocks_crossing_midnight(trades):
+    from_utc, to_utc = DAY, DAY + datetime.timedelta(days=4)
+    whole = trades.calculate_netborder(trades.get_trades(from_utc, to_utc))
+    chunks = list(trades.iter_netborder(from_utc, to_utc))
+
+    # a frame per day with trades or carried blocks, each with the quarter-hours of its own day only
+    assert len(chunks) == 3
+    for day, chunk in enumerate(chunks):
+        assert chunk[0]["UTCTIME"].between(DAY + datetime.timedelta(days=day), DAY + datetime.timedelta(days=day + 1), inclusive="left").all()
+
+    # upserting the chunks gives the netborder and per product frames of the whole range at once
+    key_cols = ["UTCTIME", "BUYERAREA", "SELLERAREA"]
+    for i in range(4):
+        expected = upserted([whole[i]], key_cols)
+        pd.testing.assert_frame_equal(upserted([chunk[i] for chunk in chunks], key_cols)[expected.columns], expected, check_categorical=False)
+
+    # the first quarter-hour after midnight: the 15 minute product and both blocks
+    first = upserted([chunk[0] for chunk in chunks], key_cols).set_index("UTCTIME").loc[DAY + datetime.timedelta(days=1)]
+    assert first["VOLUME"] == pytest.approx(2.0 + 5.0 + 1.0)
+    assert first["PRICE"] == pytest.approx((2.0 * 40.0 + 5.0 * 80.0 + 1.0 * 60.0) / 8.0)
@@ -0,0 +1,152 @@
+import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyodbc", exc_type=ImportError) # needs the unixODBC driver manager
+
+import src.intraday.intraday_trades as intraday_trades
+import src.intraday.live_intraday_trades as live_intraday_trades
+from src.intraday.delivery_areas import AREA_CODE_DTYPE
+from src.intraday.intraday_trades import EPEX_TRADE_DTYPES, XBID_STATS_WINDOWS
+from src.intraday.live_intraday_trades import LiveIntradayTrades
+from src.intraday.xbid_stats import XBID_STATS, is_incremental
+
+START = datetime.datetime(2024, 6, 21, 20, 10)
+POLL = datetime.timedelta(minutes=30)
+POLLS = 12 # 6 hours, over midnight: the window start moves every hour and a delivery day is evicted
+BACKLOG = 48 # polls of trades before the first one
+AREAS = ["BE", "NL", "FR", "DE"]
+INCREMENTAL_STATS = [stat for stat in XBID_STATS if is_incremental([stat])]
+
+
+class Exchange:
+    # The trades published per poll by EPEX and Nordpool, answering the queries of LiveIntradayTrades. Nordpool
+    # publishes about half of the EPEX trades too, a few polls before or after EPEX, and EPEX has identical trades.
+    # The first poll also publishes the trades of the day before, whose deliveries leave the window.
+    def __init__(self, seed):
+        rnd = np.random.default_rng(seed)
+        epex, nordpool = [], []
+        for poll in range(-BACKLOG, POLLS):
+            now = START + poll * POLL
+            n = 30
+            trade_time = pd.Timestamp(now - POLL) + pd.to_timedelta(np.arange(1, n + 1) * (POLL.total_seconds() / (n + 1)), unit="s")
+            minutes = rnd.choice([15, 30, 60, 60, 240], n)
+            # delivered up to a day after the trade, a few long before it (arriving late, outside the window)
+            start = (trade_time + pd.to_timedelta(rnd.integers(1, 96, n) * 15, unit="min")).floor("H") \
+                + pd.to_timedelta(rnd.integers(0, 4, n) * 15 * (minutes == 15), unit="min")
+            start = start.where(rnd.random(n) >= 0.03, start - pd.Timedelta(days=2))
+            buyer = rnd.integers(0, len(AREAS), n)
+            trades = pd.DataFrame({
+                "PRICE": rnd.choice(np.arange(-20.0, 200.0, 12.5), n), "VOLUME": rnd.integers(1, 50, n) / 10,
+                "DELIVERYSTARTUTC": start, "DELIVERYENDUTC": start + pd.to_timedelta(minutes, unit="min"),
+                "BUYERAREA": [AREAS[i] for i in buyer], "SELLERAREA": [AREAS[(i + 1 + rnd.integers(0, len(AREAS) - 1)) % len(AREAS)] for i in buyer],
+                "TRADETIMEUTC": trade_time, "POLL": max(poll, 0),
+            })
+            # identical EPEX trades (a replaced nordpool trade keeps its own lead time, which is the same for a twin)
+            trades = pd.concat([trades, trades.sample(4, random_state=rnd.integers(2 ** 31))], ignore_index=True)
+            epex.append(trades)
+
+            twins = trades[rnd.random(len(trades)) < 0.5].assign(POLL=lambda df: np.clip(df["POLL"] + rnd.integers(-2, 3, len(df)), 0, POLLS - 1))
+            own = trades.sample(10, random_state=rnd.integers(2 ** 31)).assign(PRICE=lambda df: df["PRICE"] + 0.01,
+                                                                                TRADETIMEUTC=lambda df: df["TRADETIMEUTC"] + pd.Timedelta(milliseconds=2))
+            nordpool.extend([twins, own])
+
+        self.epex = self._published(pd.concat(epex, ignore_index=True))
+        self.nordpool = self._published(pd.concat(nordpool, ignore_index=True))
+        self.poll = 0
+
+    @staticmethod
+    def _published(trades):
+        # IDs in publication order
+        trades = trades.sort_values("POLL", kind="stable").reset_index(drop=True)
+        trades.insert(0, "ID", np.arange(1, len(trades) + 1))
+        trades = trades.astype(EPEX_TRADE_DTYPES)
+        return trades.assign(BUYERAREA=trades["BUYERAREA"].astype(AREA_CODE_DTYPE), SELLERAREA=trades["SELLERAREA"].astype(AREA_CODE_DTYPE))
+
+    def queries(self, trades):
+        def get_trades(from_utc, to_utc, start_to=None):
+            published = trades[trades["POLL"] <= self.poll].drop(columns="POLL")
+            start, end = published["DELIVERYSTARTUTC"], published["DELIVERYENDUTC"]
+            return published[(start >= from_utc) & (start < (start_to or to_utc)) & (end <= to_utc)].reset_index(drop=True)
+
+        def get_new_trades(id_from):
+            published = trades[(trades["POLL"] <= self.poll) & (trades["ID"] > id_from)].drop(columns="POLL")
+            return published.reset_index(drop=True) if len(published) > 0 else None
+
+        return get_trades, get_new_trades
+
+
+@pytest.fixture
+def live(monkeypatch):
+    def live(seed, lt_stats):
+        exchange = Exchange(seed)
+        clock = SimpleNamespace(now=START)
+        monkeypatch.setattr(live_intraday_trades, "datetime", SimpleNamespace(
+            datetime=SimpleNamespace(utcnow=lambda: clock.now), timedelta=datetime.timedelta))
+        monkeypatch.setattr(intraday_trades.HexatradersDatabase, "get_instance", staticmethod(lambda: None))
+        monkeypatch.setattr(intraday_trades.HexatradersDatabase_RO, "get_instance", staticmethod(lambda: None))
+
+        lit = LiveIntradayTrades(region="Belgium", lt_stats=lt_stats)
+        get_epex_trades, get_new_epex_trades = exchange.queries(exchange.epex)
+        get_np_trades, get_new_np_trades = exchange.queries(exchange.nordpool)
+        monkeypatch.setattr(lit, "_get_epex_trades", get_epex_trades)
+        monkeypatch.setattr(lit, "_get_new_epex_trades", get_new_epex_trades)
+        monkeypatch.setattr(lit, "_get_np_trades", get_np_trades)
+        monkeypatch.setattr(lit, "_get_new_np_trades", get_new_np_trades)
+
+        def polls():
+            for poll in range(POLLS):
+                exchange.poll, clock.now = poll, START + poll * POLL
+                lit.update()
+                yield poll
+
+        return lit, polls()
+
+    return live
+
+
+def assert_same_rows(actual, expected, key_cols):
+    def normalized(df):
+        df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+        return df.sort_values(key_cols).reset_index(drop=True)
+
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(normalized(actual), normalized(expected), check_dtype=False, rtol=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_live_netborder_equals_netborder_of_live_trades(live, seed):
+    lit, polls = live(seed, INCREMENTAL_STATS)
+    evicted = set()
+
+    for _ in polls:
+        evicted.add(lit._from_utc)
+        trades = lit.get_live_trades(update=False)
+        expected = lit.calculate_netborder(trades)
+        actual = lit.get_live_netborder(update=False)
+
+        for frame, expected_frame, key_cols in zip(actual, expected, [["UTCTIME", "BUYERAREA", "SELLERAREA"]] + [["UTCTIME", "BUYERAREA", "SELLERAREA", "DELIVERYENDUTC"]] * 3):
+            assert_same_rows(frame, expected_frame, key_cols)
+
+    # the window moved every hour and a delivery day left it
+    assert len(evicted) == POLLS // 2
+    assert min(day.date() for day in lit._epex_trades.to_frame()["DELIVERYSTARTUTC"]) == START.date()
+
+
+@pytest.mark.parametrize("seed", range(2))
+@pytest.mark.parametrize("lt_stats", [INCREMENTAL_STATS, ["VOLUME", "P10_PRICE", "P50_PRICE"]])
+def test_live_xbid_stats_equal_xbid_stats_of_live_trades(live, seed, lt_stats):
+    lit, polls = live(seed, lt_stats)
+
+    for _ in polls:
+        expected = lit.get_xbid_stats_lt(lit.get_live_trades(update=False), windows=XBID_STATS_WINDOWS, stats=lt_stats)
+        actual = lit.get_live_xbid_stats_lt(update=False)
+
+        assert_same_rows(actual, expected, ["UTCTIME", "BUYERAREA", "SELLERAREA", "DELIVERYENDUTC", "TAG"])
+
+    # the quantiles are not mergeable: calculated from the live trades instead of running partials
+    assert (lit._lt_partials is None) == (not is_incremental(lt_stats))
+    assert len(actual) > 0
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyodbc", exc_type=ImportError) # needs the unixODBC driver manager
+
+import src.intraday.intraday_trades as intraday_trades
+from src.intraday.xbid_stats import DEFAULT_XBID_STATS
+from src.tasks.live_intraday_trades_task import LiveIntradayTradesTask
+from src.utils.database.sinks import MultiSinkWriter, TableSink
+from src.utils.database.write_behind import WriteBehindQueue
+
+UTCTIME = pd.Timestamp("2024-06-21 10:00")
+
+
+@pytest.fixture
+def task(monkeypatch):
+    monkeypatch.setattr(intraday_trades.HexatradersDatabase, "get_instance", staticmethod(lambda: None))
+    monkeypatch.setattr(intraday_trades.HexatradersDatabase_RO, "get_instance", staticmethod(lambda: None))
+    monkeypatch.setattr(intraday_trades.NXTDatabase, "energy", staticmethod(lambda: None))
+
+    # every table sink fails while failing is set, the written frames are kept per table
+    written, failing = {}, [True]
+    def write(sink, df):
+        if failing[0]:
+            raise Exception("connection lost")
+        written.setdefault(sink.table, []).append(df)
+    monkeypatch.setattr(TableSink, "write", write)
+
+    task = LiveIntradayTradesTask(region="Belgium")
+    queue = WriteBehindQueue(writer=MultiSinkWriter(max_workers=2), retry_delay=0.01, max_attempts=2)
+    task.writer = task.lit.writer = queue
+
+    netborder = pd.DataFrame({"UTCTIME": [UTCTIME], "BUYERAREA": ["BE"], "SELLERAREA": ["NL"], "VOLUME": [10.0], "PRICE": [50.0]})
+    netborder_h = netborder.assign(PRODUCTTYPE="H")
+    lt_stats = pd.DataFrame([{"UTCTIME": UTCTIME, "PRODUCTTYPE": "H", "TAG": "ALL", "BUYERAREA": "BE", "SELLERAREA": "NL",
+                              **{stat: 1.0 for stat in DEFAULT_XBID_STATS}}])
+    monkeypatch.setattr(task.lit, "get_live_netborder", lambda: (netborder, netborder_h, netborder_h.iloc[:0], netborder_h.iloc[:0]))
+    monkeypatch.setattr(task.lit, "get_live_xbid_stats_lt", lambda update: lt_stats)
+
+    yield task, queue, written, failing
+    queue.close(timeout=0)
+
+
+def test_dropped_uploads_are_sent_again_on_next_run(task):
+    task, queue, written, failing = task
+
+    task.run()
+    assert queue.flush(timeout=5) # dropped after max_attempts
+    assert written == {}
+
+    # unchanged since the previous run, but not written
+    failing[0] = False
+    task.run()
+    assert queue.flush(timeout=5)
+    assert sorted(written) == ["XBID_STATS", "XBID_TRADES", "traders.XBID_TRADES", "traders.XBID_TRADES_PER_PRODUCT"]
+
+    # written, so a third run has nothing to send
+    written.clear()
+    task.run()
+    assert queue.flush(timeout=5)
+    assert written == {}
@@ -0,0 +1,140 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyodbc", exc_type=ImportError) # needs the unixODBC driver manager
+
+import src.utils.database.msdb_elindus as msdb_elindus
+from src.utils.database.change_detection import RowDigestCache
+from src.utils.database.msdb_elindus import MSDatabaseAbstract
+from src.utils.database.nxtdatabase import NXTDatabase
+
+KEY_COLS = ["UTCTIME", "AREA"]
+DATA_COLS = ["VOLUME", "PRICE"]
+
+
+def frame(prices, volumes=None):
+    return pd.DataFrame({
+        "UTCTIME": pd.date_range("2024-06-21", periods=len(prices), freq="15min"),
+        "AREA": "BE",
+        "VOLUME": volumes if volumes is not None else [1.0] * len(prices),
+        "PRICE": prices,
+        "COMMENT": "not a data column",
+    })
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RowDigestCache()
+    monkeypatch.setattr(RowDigestCache, "_instance", cache)
+    return cache
+
+
+class FakeConnection:
+    # a DBAPI connection recording the upserted rows, whose execute fails while fail is set
+    def __init__(self, engine):
+        self.engine = engine
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        if self.engine.fail:
+            raise Exception("connection lost")
+        self.engine.params.append(params)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeEngine:
+    def __init__(self):
+        self.fail = False
+        self.params = []
+
+    def raw_connection(self):
+        return FakeConnection(self)
+
+    def upserted_prices(self):
+        # the PRICE of every row sent since the last call
+        prices = [value for params in self.params for value in params[len(KEY_COLS) + 1::len(KEY_COLS + DATA_COLS)]]
+        self.params = []
+        return prices
+
+
+@pytest.fixture
+def nxt():
+    db = NXTDatabase(server="server", user="user", password="password", database="database")
+    db._engine = FakeEngine()
+    return db
+
+
+def test_nxt_upsert_skips_unchanged_rows(cache, nxt):
+    nxt.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    assert nxt._engine.upserted_prices() == [10.0, 20.0]
+
+    nxt.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    assert nxt._engine.upserted_prices() == []
+
+    nxt.bulk_upsert(frame([10.0, 25.0, 30.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    assert nxt._engine.upserted_prices() == [25.0, 30.0]
+
+    # without skip_unchanged everything is sent
+    nxt.bulk_upsert(frame([10.0, 25.0, 30.0]), "T", KEY_COLS, DATA_COLS)
+    assert nxt._engine.upserted_prices() == [10.0, 25.0, 30.0]
+
+
+def test_nxt_rows_of_failed_upsert_are_retried(cache, nxt):
+    nxt._engine.fail = True
+    with pytest.raises(Exception, match="connection lost"):
+        nxt.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+
+    nxt._engine.fail = False
+    nxt.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    assert nxt._engine.upserted_prices() == [10.0, 20.0]
+
+
+@pytest.fixture
+def msdb(monkeypatch):
+    # the upserts of the base class recorded, failing while fail is set
+    db = MSDatabaseAbstract(host="host", database="database", username="user", password="password")
+    db.fail, db.upserted = False, []
+
+    def bulk_upsert(self, df, table, key_cols, data_cols, moddate_col=None, conn=None):
+        if self.fail:
+            raise Exception("connection lost")
+        self.upserted.extend(df["PRICE"])
+
+    monkeypatch.setattr(msdb_elindus.MSDatabaseElindus, "bulk_upsert", bulk_upsert)
+    return db
+
+
+def test_msdb_upsert_skips_unchanged_rows(cache, msdb):
+    msdb.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    msdb.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    msdb.bulk_upsert(frame([10.0, 25.0, 30.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+
+    assert msdb.upserted == [10.0, 20.0, 25.0, 30.0]
+
+
+def test_msdb_rows_of_failed_upsert_are_retried(cache, msdb):
+    msdb.fail = True
+    with pytest.raises(Exception, match="connection lost"):
+        msdb.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+
+    msdb.fail = False
+    msdb.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+    assert msdb.upserted == [10.0, 20.0]
+
+
+def test_msdb_upsert_in_callers_transaction_is_not_remembered(cache, msdb):
+    # the caller may still roll back its connection
+    msdb.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, conn=object(), skip_unchanged=True)
+    msdb.bulk_upsert(frame([10.0, 20.0]), "T", KEY_COLS, DATA_COLS, skip_unchanged=True)
+
+    assert msdb.upserted == [10.0, 20.0, 10.0, 20.0]
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.intraday.trade_store import TradeStore, HOUR_NS
+
+DAY = pd.Timestamp("2024-03-31")
+
+
+def random_trades(rnd, n=400, no_trade_time=0.1):
+    # quarter-hours of a day, traded up to 10 hours before delivery (and a few after it), some without trade time
+    start = DAY + pd.to_timedelta(rnd.integers(0, 96, n) * 15, unit="min")
+    trade_time = start - pd.to_timedelta(rnd.integers(-30, 600, n), unit="min")
+    return pd.DataFrame({
+        "DELIVERYSTARTUTC": start,
+        "DELIVERYENDUTC": start + pd.Timedelta(minutes=15),
+        "TRADETIMEUTC": trade_time.where(rnd.random(n) >= no_trade_time),
+        "PRICE": rnd.normal(80, 20, n),
+    }, index=rnd.permutation(n) + 1000)
+
+
+def brute_force_rows(trades, lead_from, lead_to):
+    # store positions of the trades with lead_to <= lead time (to their delivery hour) <= lead_from, None for unbounded
+    hour = trades["DELIVERYSTARTUTC"].dt.floor("H")
+    lead = (hour - trades["TRADETIMEUTC"]).to_numpy().view("int64")
+    mask = trades["TRADETIMEUTC"].notna().to_numpy()
+    if lead_from is not None:
+        mask &= lead <= lead_from
+    if lead_to is not None:
+        mask &= lead >= lead_to
+    # trades without trade time are traded after all others, only in windows up to the end of their hour
+    mask |= trades["TRADETIMEUTC"].isna().to_numpy() & (lead_to is None)
+    return mask
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_trades_are_sorted_by_delivery_hour_and_trade_time(seed):
+    trades = random_trades(np.random.default_rng(seed))
+    store = TradeStore(trades)
+
+    expected = trades.assign(HOUR=trades["DELIVERYSTARTUTC"].dt.floor("H")) \
+        .sort_values(["HOUR", "TRADETIMEUTC"], kind="stable", na_position="last").drop(columns="HOUR").reset_index(drop=True)
+    pd.testing.assert_frame_equal(store.trades, expected)
+    assert len(store) == len(trades)
+    assert list(store.hours.view("int64") % HOUR_NS) == [0] * len(store.hours)
+    assert store.hour_offsets[-1] == len(trades)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("lead_from,lead_to", [(None, None), (None, 0), (3, 1), (1, 0), (8, None), (0.25, -0.5), (20, 12)])
+def test_lead_time_slices_equal_brute_force_filter(seed, lead_from, lead_to):
+    trades = random_trades(np.random.default_rng(seed))
+    store = TradeStore(trades)
+    lead_from = None if lead_from is None else int(lead_from * HOUR_NS)
+    lead_to = None if lead_to is None else int(lead_to * HOUR_NS)
+
+    begin = store.first_rows(lead_from)
+    end = store.hour_offsets[1:] if lead_to is None else store.end_rows(lead_to)
+    rows = store.rows(begin, end)
+
+    expected = brute_force_rows(store.trades, lead_from, lead_to)
+    assert sorted(rows) == list(np.flatnonzero(expected))
+    assert (np.diff(rows) > 0).all()
+
+
+def test_take_and_column_select_rows_in_store_order():
+    trades = random_trades(np.random.default_rng(0))
+    store = TradeStore(trades)
+    rows = np.array([0, 5, 17, len(trades) - 1])
+
+    pd.testing.assert_frame_equal(store.take(rows, ["TRADETIMEUTC", "PRICE"]), store.trades.loc[rows, ["TRADETIMEUTC", "PRICE"]].reset_index(drop=True))
+    assert list(store.column("PRICE", rows)) == list(store.trades.loc[rows, "PRICE"])
+
+
+def test_trades_without_trade_time():
+    trades = random_trades(np.random.default_rng(0), n=20, no_trade_time=1)
+    store = TradeStore(trades)
+
+    assert list(store.rows(store.first_rows(HOUR_NS), store.hour_offsets[1:])) == list(range(20))
+    assert len(store.rows(store.first_rows(HOUR_NS), store.end_rows(1))) == 0
+
+
+def test_empty_store():
+    store = TradeStore(random_trades(np.random.default_rng(0), n=0))
+
+    assert len(store) == 0
+    assert len(store.hours) == 0
+    assert len(store.rows(store.first_rows(HOUR_NS), store.hour_offsets[1:])) == 0
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyodbc", exc_type=ImportError) # needs the unixODBC driver manager
+
+import src.tasks.transnet_tasks as transnet_tasks
+from src.tasks.transnet_tasks import UploadPICASSOMOLTask
+from src.utils.database.sinks import SinkWriteError
+
+
+class FlakySink:
+    # fails its first `failures` writes
+    key_cols = ["UTCTIME"]
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.written = []
+
+    def __str__(self):
+        return "FlakySink"
+
+    def write(self, df):
+        if self.failures > 0:
+            self.failures -= 1
+            raise Exception("connection lost")
+        self.written.append(df)
+
+
+@pytest.fixture
+def task(tmp_path, monkeypatch):
+    monkeypatch.setattr(transnet_tasks, "CACHE_PATH", str(tmp_path))
+    task = UploadPICASSOMOLTask(frequency=60)
+
+    sink = FlakySink(failures=1)
+    committed = []
+
+    # every day has one changed quarter-hour, written to the flaky sink through the task's (synchronous) writer
+    def upload_mols(cmols, on_written=None, on_failed=None):
+        task.writer.write_many([(sink, pd.DataFrame({"UTCTIME": cmols}))], on_written=on_written, on_failed=on_failed)
+
+    monkeypatch.setattr(task.transnet_api, "get_picasso_cmol", lambda dt, incremental: [dt])
+    monkeypatch.setattr(task.transnet_api, "upload_mols", upload_mols)
+    monkeypatch.setattr(task.transnet_api, "commit_picasso_cmol", committed.append)
+
+    return task, sink, committed
+
+
+def test_failed_upload_is_retried_on_next_run(task):
+    task, sink, committed = task
+    yesterday = date.today() - timedelta(days=1)
+
+    with pytest.raises(SinkWriteError):
+        task.upload_data()
+
+    assert committed == []
+    assert yesterday not in task._uploading
+
+    task.upload_data()
+
+    assert committed == [yesterday, date.today()]
+    assert [df["UTCTIME"].iloc[0] for df in sink.written] == [yesterday, date.today()]
+    assert task._uploading == set()
@@ -0,0 +1,112 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from src.utils.database.sinks import MultiSinkWriter
+from src.utils.database.write_behind import WriteBehindQueue
+
+
+class Sink:
+    # fails every write while failing is set
+    key_cols = ["KEY"]
+
+    def __init__(self, name, failing=False):
+        self.name = name
+        self.failing = failing
+        self.attempts = 0
+        self.written = []
+
+    def __str__(self):
+        return self.name
+
+    def write(self, df):
+        self.attempts += 1
+        if self.failing:
+            raise Exception("connection lost")
+        self.written.append(df)
+
+
+def frame(n):
+    return pd.DataFrame({"KEY": range(n), "VALUE": 1.0})
+
+
+@pytest.fixture
+def queue():
+    queues = []
+
+    def create(**kwargs):
+        queues.append(WriteBehindQueue(writer=MultiSinkWriter(max_workers=2), **kwargs))
+        return queues[-1]
+
+    yield create
+    for queue in queues:
+        queue.close(timeout=0)
+
+
+def test_failing_sink_does_not_hold_up_the_others(queue):
+    queue = queue(max_pending_rows=10, retry_delay=60)
+    broken, healthy = Sink("broken", failing=True), Sink("healthy")
+
+    queue.write(frame(10), [broken])
+    written = threading.Event()
+    # the broken sink is over its budget and waits for its retry, the healthy one is neither blocked nor delayed
+    writer = threading.Thread(target=lambda: [queue.write(frame(10), [healthy], on_written=written.set) for _ in range(3)], daemon=True)
+    writer.start()
+    writer.join(timeout=5)
+
+    assert not writer.is_alive()
+    assert written.wait(timeout=5)
+    assert broken.attempts == 1
+
+
+def test_failing_sink_is_dropped_after_max_attempts(queue):
+    queue = queue(retry_delay=0.01, max_attempts=3)
+    broken, healthy = Sink("broken", failing=True), Sink("healthy")
+    written, failed = threading.Event(), threading.Event()
+
+    queue.write(frame(5), [broken, healthy], on_written=written.set, on_failed=failed.set)
+
+    assert queue.flush(timeout=5)
+    assert failed.is_set() and not written.is_set()
+    assert broken.attempts == 3
+    assert len(healthy.written) == 1
+
+    # rows queued after the drop are attempted again once the sink is back
+    broken.failing = False
+    queue.write(frame(5), [broken], on_written=written.set)
+
+    assert queue.flush(timeout=5)
+    assert written.is_set()
+    assert len(broken.written) == 1
+
+
+def test_failed_rows_are_retried_before_newer_ones(queue):
+    queue = queue(retry_delay=0.2)
+    sink = Sink("sink", failing=True)
+
+    queue.write(pd.DataFrame({"KEY": [1, 2], "VALUE": [1.0, 1.0]}), [sink])
+    queue.write(pd.DataFrame({"KEY": [2], "VALUE": [2.0]}), [sink])
+    sink.failing = False
+
+    assert queue.flush(timeout=5)
+    written = pd.concat(sink.written).set_index("KEY")["VALUE"]
+    assert written.to_dict() == {1: 1.0, 2: 2.0}
+
+
+def test_frames_that_cannot_be_coalesced_are_dropped(queue):
+    queue = queue(retry_delay=0.01)
+    bad, healthy = Sink("bad"), Sink("healthy")
+    bad.key_cols = ["MISSING"]
+    written, failed = threading.Event(), threading.Event()
+
+    queue.write(frame(5), [bad, healthy], on_written=written.set, on_failed=failed.set)
+
+    assert queue.flush(timeout=5)
+    assert failed.is_set() and not written.is_set()
+    assert bad.attempts == 0 and len(healthy.written) == 1
+
+    # the background thread is still writing
+    queue.write(frame(5), [healthy], on_written=written.set)
+    assert queue.flush(timeout=5)
+    assert written.is_set()
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.intraday.xbid_stats import XBID_STATS, calculate_partials, merge_partials, cumulate_partials, calculate_stats, is_incremental
+
+INCREMENTAL_STATS = [stat for stat in XBID_STATS if is_incremental([stat])]
+QUANTILE_STATS = [stat for stat in XBID_STATS if not is_incremental([stat])]
+DELIVERY = pd.Timestamp("2024-06-21 12:00")
+
+
+def random_trades(rnd, n=300, groups=6, buckets=4):
+    # trades of a few groups over nested window buckets, a tighter bucket (smaller lead time) has later trades,
+    # with tied prices and trade times, zero volumes and zero weights (replaced live trades)
+    bucket = rnd.integers(0, buckets, n)
+    lead_hours = bucket + rnd.integers(0, 4, n) / 4
+    return pd.DataFrame({
+        "GROUP": rnd.integers(0, groups, n),
+        "BUCKET": bucket,
+        "PRICE": rnd.choice([-10.0, 0.0, 42.5, 80.0, 80.0, 120.0], n),
+        "VOLUME": rnd.choice([0.0, 0.1, 1.0, 2.5, 10.0], n),
+        "WEIGHT": rnd.choice([0.0, 1.0, 1.0, 1.0, 2.0], n),
+        "LEAD_HOURS": lead_hours,
+        "TRADETIMEUTC": DELIVERY - pd.to_timedelta(lead_hours, unit="h"),
+    })
+
+
+def assert_stats_equal(actual, expected):
+    pd.testing.assert_frame_equal(actual.sort_index(), expected.sort_index(), check_exact=False, rtol=1e-9, atol=1e-9, check_dtype=False)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_merged_partials_equal_partials_of_all_trades(seed):
+    rnd = np.random.default_rng(seed)
+    trades = random_trades(rnd)
+    # frames in arrival order, a frame never has a trade earlier than one of the frames before it on the same time
+    trades = trades.sort_values("TRADETIMEUTC", kind="stable").reset_index(drop=True)
+    splits = np.sort(rnd.choice(np.arange(1, len(trades)), 3, replace=False))
+    frames = [calculate_partials(part, INCREMENTAL_STATS, ["GROUP", "BUCKET"]) for part in np.split(trades, splits)]
+
+    merged = merge_partials(frames, INCREMENTAL_STATS)
+    expected = calculate_partials(trades, INCREMENTAL_STATS, ["GROUP", "BUCKET"])
+
+    assert_stats_equal(calculate_stats(merged, INCREMENTAL_STATS), calculate_stats(expected, INCREMENTAL_STATS))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_cumulated_partials_equal_partials_of_window_trades(seed):
+    trades = random_trades(np.random.default_rng(seed))
+    partials = calculate_partials(trades, INCREMENTAL_STATS, ["GROUP", "BUCKET"])
+
+    cumulated = cumulate_partials(partials, INCREMENTAL_STATS, pd.RangeIndex(4))
+    assert list(cumulated) == [0, 1, 2, 3]
+    for bucket, window_partials in cumulated.items():
+        window_trades = trades[trades["BUCKET"] <= bucket]
+        expected = calculate_partials(window_trades, INCREMENTAL_STATS, ["GROUP"])
+        assert_stats_equal(calculate_stats(window_partials, INCREMENTAL_STATS), calculate_stats(expected, INCREMENTAL_STATS))
+
+
+def test_cumulated_partials_of_groups_without_trades_in_tight_buckets():
+    trades = pd.DataFrame({"GROUP": [0, 0, 1], "BUCKET": [2, 0, 3], "PRICE": [10.0, 20.0, 30.0], "VOLUME": [1.0, 3.0, 2.0], "WEIGHT": 1.0,
+                           "LEAD_HOURS": [2.0, 0.0, 3.0], "TRADETIMEUTC": DELIVERY - pd.to_timedelta([2.0, 0.0, 3.0], unit="h")})
+    partials = calculate_partials(trades, ["VOLUME", "LAST_PRICE", "MIN_PRICE"], ["GROUP", "BUCKET"])
+    cumulated = cumulate_partials(partials, ["VOLUME", "LAST_PRICE", "MIN_PRICE"], pd.RangeIndex(4))
+
+    stats = {bucket: calculate_stats(window, ["VOLUME", "LAST_PRICE", "MIN_PRICE"]) for bucket, window in cumulated.items()}
+    assert stats[0].to_dict("index") == {0: {"VOLUME": 3.0, "LAST_PRICE": 20.0, "MIN_PRICE": 20.0}}
+    assert stats[1].to_dict("index") == {0: {"VOLUME": 3.0, "LAST_PRICE": 20.0, "MIN_PRICE": 20.0}}
+    assert stats[2].to_dict("index") == {0: {"VOLUME": 4.0, "LAST_PRICE": 20.0, "MIN_PRICE": 10.0}}
+    assert stats[3].to_dict("index") == {0: {"VOLUME": 4.0, "LAST_PRICE": 20.0, "MIN_PRICE": 10.0}, 1: {"VOLUME": 2.0, "LAST_PRICE": 30.0, "MIN_PRICE": 30.0}}
+
+
+def loop_quantile(trades, quantile):
+    # the lowest price at which the weighted volume of the trades up to that price reaches the quantile
+    trades = trades[trades["WEIGHT"] > 0].sort_values("PRICE", kind="stable")
+    volumes = (trades["WEIGHT"] * trades["VOLUME"]).tolist()
+    total, cumulative = sum(volumes), 0
+    for price, volume in zip(trades["PRICE"], volumes):
+        cumulative += volume
+        if cumulative >= quantile * total - 1e-9:
+            return price
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_quantile_stats_from_window_trades(seed):
+    trades = random_trades(np.random.default_rng(seed))
+    partials = calculate_partials(trades, QUANTILE_STATS, ["GROUP"])
+
+    # not mergeable: calculated from the trades instead of the partials
+    assert not is_incremental(QUANTILE_STATS)
+    stats = calculate_stats(partials, QUANTILE_STATS, trades, ["GROUP"])
+
+    for group, group_trades in trades.groupby("GROUP"):
+        for stat in QUANTILE_STATS:
+            expected = loop_quantile(group_trades, XBID_STATS[stat].quantile)
+            assert (pd.isna(stats.loc[group, stat]) and expected is None) or stats.loc[group, stat] == expected